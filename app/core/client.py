@@ -1,25 +1,54 @@
+import importlib.util
+
 import httpx
 from fastapi import FastAPI
 
 from .config import get_settings
 from app.core import logger
 
+def _http2_enabled(settings) -> bool:
+    if not settings.GATEWAY_HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("GATEWAY_HTTP2 включен, но пакет h2 не установлен: используется HTTP/1.1")
+        return False
+    return True
+
+
 async def init_gateway_client(app: FastAPI):
     """
     Создает экземпляр HTTPX клиента и сохраняет его в app.state.
     Вызывается при старте приложения.
     """
     settings = get_settings()
+    limits = httpx.Limits(
+        max_connections=settings.GATEWAY_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.GATEWAY_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.GATEWAY_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        settings.TIMEOUT,
+        connect=settings.GATEWAY_CONNECT_TIMEOUT or settings.TIMEOUT,
+        read=settings.GATEWAY_READ_TIMEOUT or settings.TIMEOUT,
+        write=settings.GATEWAY_WRITE_TIMEOUT or settings.TIMEOUT,
+        pool=settings.GATEWAY_POOL_TIMEOUT or settings.TIMEOUT,
+    )
+    http2 = _http2_enabled(settings)
     gateway_client = httpx.AsyncClient(
         base_url=settings.BASE_URL,
         headers={
             "X-API-KEY": settings.GATEWAY_API_KEY,
             "X-Session-ID": settings.GATEWAY_SESSION_ID,
         },
-        timeout=settings.TIMEOUT
+        timeout=timeout,
+        limits=limits,
+        http2=http2,
     )
     app.state.gateway_client = gateway_client
-    logger.info(f"Gateway client initialized for base_url: {settings.BASE_URL}")
+    logger.info(
+        f"Gateway client initialized for base_url: {settings.BASE_URL} "
+        f"(max_connections={limits.max_connections}, keepalive={limits.max_keepalive_connections}, http2={http2})"
+    )
 
 
 async def shutdown_gateway_client(app: FastAPI):
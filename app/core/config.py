@@ -16,6 +16,125 @@ class Settings(BaseSettings):
 
     LOGS_LEVEL: str = "INFO"
 
+    # Пул соединений HTTP-клиента шлюза
+    GATEWAY_MAX_CONNECTIONS: int = 100
+    GATEWAY_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    GATEWAY_KEEPALIVE_EXPIRY: float = 30.0
+    # HTTP/2 требует установленного пакета h2 (pip install httpx[http2])
+    GATEWAY_HTTP2: bool = False
+    # Раздельные таймауты (сек.); если не заданы, используется TIMEOUT
+    GATEWAY_CONNECT_TIMEOUT: float | None = None
+    GATEWAY_READ_TIMEOUT: float | None = None
+    GATEWAY_WRITE_TIMEOUT: float | None = None
+    GATEWAY_POOL_TIMEOUT: float | None = None
+
+    # Повторы идемпотентных запросов к шлюзу (ошибки сети, 5xx, 429)
+    GATEWAY_RETRY_ATTEMPTS: int = 3
+    GATEWAY_RETRY_BACKOFF_BASE: float = 0.5
+    GATEWAY_RETRY_BACKOFF_MAX: float = 10.0
+    GATEWAY_RETRY_AFTER_MAX: float = 60.0
+
+    # Ограничение частоты запросов к шлюзу (token bucket); 0 — без ограничения.
+    # Token bucket, circuit breaker и AIMD-лимит ниже работают в пределах процесса:
+    # при WEB_CONCURRENCY > 1 нагрузка на шлюз до WEB_CONCURRENCY раз выше, значения задаются на процесс
+    GATEWAY_RATE_LIMIT_RPS: float = 20.0
+    GATEWAY_RATE_LIMIT_BURST: int = 40
+
+    # Circuit breaker: после N запросов подряд, не выполненных и после повторов,
+    # запросы к шлюзу приостанавливаются на заданное время (сек.)
+    GATEWAY_BREAKER_FAILURE_THRESHOLD: int = 5
+    GATEWAY_BREAKER_RESET_TIMEOUT: float = 30.0
+    # Сколько секунд запрос, отклоненный circuit breaker, ждет пробного запроса и закрытия
+    # выключателя, прежде чем задача завершится ошибкой; 0 — не ждать
+    GATEWAY_BREAKER_WAIT_MAX: float = 60.0
+
+    # Адаптивный (AIMD) лимит одновременных запросов к шлюзу на процесс
+    GATEWAY_CONCURRENCY_INITIAL: int = 10
+    GATEWAY_CONCURRENCY_MIN: int = 1
+    GATEWAY_CONCURRENCY_MAX: int = 64
+    GATEWAY_LATENCY_TARGET: float = 2.0
+    GATEWAY_CONCURRENCY_DECREASE_FACTOR: float = 0.7
+
+    # Разбор ответов шлюза: "auto" | "ijson" (потоковый) | "orjson" | "json" (см. app/service/projection.py)
+    GATEWAY_JSON_PARSER: str = "auto"
+
+    # Максимальное число одновременных запросов к шлюзу на одном этапе обработки
+    PROCESSING_CONCURRENCY: int = 10
+
+    # Пакетный поиск ID пациентов: "off" — по одному запросу на пациента,
+    # "surname" — один запрос на фамилию, пациенты находятся среди ответа по ФИО и дате рождения.
+    # Усеченные ответы и пациенты, чей результат может зависеть от правил сравнения ФИО шлюзом,
+    # ищутся по одному. Включать после проверки на реальном шлюзе: в строках ответа должны быть
+    # поля Person_Surname, Person_Firname, Person_Secname и Person_BirthDay (дата как "дд.мм.гггг"),
+    # иначе каждая группа стоит лишнего запроса
+    PERSON_BATCH_MODE: str = "off"
+    PERSON_BATCH_MIN_GROUP: int = 2
+
+    # Запрашивать в мед. истории только посещения поликлиники (EvnPL) — единственные события,
+    # по которым определяется тип оплаты. Уменьшает ответ getPersonHistory
+    MEDICAL_HISTORY_VISITS_ONLY: bool = False
+
+    # Режим обогащения записей: "stages" — этап за этапом по всему файлу,
+    # "streaming" — каждый пациент проходит все этапы сразу (очереди между этапами)
+    PIPELINE_MODE: str = "stages"
+    STREAMING_QUEUE_SIZE: int = 100
+
+    # Контрольные точки этапов: "off" — не сохранять, "compact" — компактный JSON,
+    # "full" — JSON с отступами. Сжатие для compact: "none", "gzip", "zstd" (нужен пакет zstandard).
+    # При установленном orjson сериализация выполняется через него.
+    CHECKPOINT_MODE: str = "compact"
+    CHECKPOINT_COMPRESSION: str = "none"
+
+    # Очередь задач обработки (SQLite, путь относительно корня проекта).
+    # JOB_WORKERS — число одновременно выполняемых задач в процессе (всего — JOB_WORKERS * WEB_CONCURRENCY);
+    # JOB_SCHEDULING: "fifo" — по времени постановки, "fair" — сначала загрузившие, у кого меньше задач в работе
+    # (загрузивший определяется по IP клиента; за обратным прокси нужен FORWARDED_ALLOW_IPS, см. Dockerfile.prod)
+    JOB_DB_PATH: str = "materials/jobs.sqlite3"
+    JOB_WORKERS: int = 2
+    JOB_SCHEDULING: str = "fair"
+    JOB_POLL_INTERVAL: float = 2.0
+    # Задача в состоянии running без heartbeat дольше JOB_STALE_TIMEOUT (сек.) считается прерванной
+    # (перезапуск процесса) и возвращается в очередь с продолжением с контрольной точки
+    JOB_HEARTBEAT_INTERVAL: float = 10.0
+    JOB_STALE_TIMEOUT: float = 60.0
+
+    # Шина сообщений о прогрессе: "local" — один процесс,
+    # "sqlite" — несколько воркеров (WEB_CONCURRENCY > 1) с общим каталогом materials
+    PROGRESS_BUS: str = "local"
+    PROGRESS_BUS_PATH: str = "materials/progress.sqlite3"
+    PROGRESS_BUS_POLL_INTERVAL: float = 0.2
+    PROGRESS_BUS_RETENTION: float = 3600.0
+    # Минимальный интервал (сек.) между промежуточными сообщениями о прогрессе одной задачи
+    PROGRESS_MIN_INTERVAL: float = 0.5
+    # История сообщений задачи, повторяемая при подключении клиента;
+    # PROGRESS_HISTORY_TASKS — сколько последних задач хранится в памяти (для PROGRESS_BUS=local)
+    PROGRESS_HISTORY_SIZE: int = 50
+    PROGRESS_HISTORY_TASKS: int = 1000
+
+    # Время жизни (сек.) и размер процессных кешей справочных запросов к шлюзу
+    CACHE_TTL_PERSON_ID: int = 12 * 3600
+    # Для "пациент не найден" и "найдено несколько" — короткое время жизни
+    CACHE_TTL_PERSON_ID_NEGATIVE: int = 5 * 60
+    CACHE_MAXSIZE_PERSON_ID: int = 20000
+    CACHE_TTL_TEST_DATA: int = 24 * 3600
+    CACHE_MAXSIZE_TEST_DATA: int = 5000
+    CACHE_TTL_TESTS_HISTORY: int = 15 * 60
+    CACHE_MAXSIZE_TESTS_HISTORY: int = 1024
+    CACHE_TTL_TEST_REPORT: int = 3600
+    CACHE_MAXSIZE_TEST_REPORT: int = 20000
+    CACHE_TTL_MEDICAL_HISTORY: int = 15 * 60
+    CACHE_MAXSIZE_MEDICAL_HISTORY: int = 1024
+    CACHE_TTL_PAY_TYPE: int = 3600
+    CACHE_MAXSIZE_PAY_TYPE: int = 20000
+
+    # Персистентный кеш (SQLite) для справочника услуг и ID пациентов.
+    # Путь указывается относительно корня проекта.
+    CACHE_PERSISTENT_ENABLED: bool = False
+    CACHE_PERSISTENT_PATH: str = "materials/lookup_cache.sqlite3"
+    CACHE_PERSISTENT_MAXSIZE: int = 100000
+    CACHE_PERSISTENT_TTL_PERSON_ID: int = 7 * 24 * 3600
+    CACHE_PERSISTENT_TTL_TEST_DATA: int = 30 * 24 * 3600
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
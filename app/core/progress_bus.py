@@ -0,0 +1,210 @@
+"""
+Шина сообщений о прогрессе задач.
+
+`ConnectionManager` публикует сообщения в шину, а шина доставляет их обработчику
+`deliver`, который отправляет сообщение в WebSocket, если клиент подключен к этому процессу.
+Сообщениям присваиваются возрастающие id. Шина также хранит последний статус задачи
+и ограниченную историю сообщений для клиентов, подключившихся позже.
+
+local  — доставка внутри процесса (один процесс uvicorn);
+sqlite — сообщения пишутся в общую таблицу SQLite, каждый процесс опрашивает ее
+         и доставляет сообщения своим клиентам. Подходит для нескольких воркеров
+         gunicorn на одной машине (общий каталог materials).
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Awaitable, Callable, Deque, List, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .logger_setup import logger
+
+Deliver = Callable[[str, int, dict], Awaitable[None]]
+
+
+def merge_status(status: dict | None, message: dict) -> dict:
+    """
+    Последний статус задачи: сообщение о новом этапе (с полем `message`) заменяет статус,
+    промежуточные обновления дополняют его (процент, detail).
+    """
+    if status is None or "message" in message:
+        return dict(message)
+    return {**status, **message}
+
+
+class LocalProgressBus:
+    """Доставка сообщений внутри процесса. История хранится для `max_tasks` последних задач."""
+
+    def __init__(self, history_size: int, max_tasks: int):
+        self.history_size = history_size
+        self.max_tasks = max_tasks
+        self._deliver: Deliver | None = None
+        self._last_id = 0
+        self._history: OrderedDict[str, Deque[Tuple[int, dict]]] = OrderedDict()
+        self._status: OrderedDict[str, dict] = OrderedDict()
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        self._deliver = None
+
+    async def publish(self, task_id: str, message: dict):
+        self._last_id += 1
+        message_id = self._last_id
+        history = self._history.get(task_id)
+        if history is None:
+            history = self._history[task_id] = deque(maxlen=self.history_size)
+        history.append((message_id, message))
+        self._status[task_id] = merge_status(self._status.get(task_id), message)
+        self._history.move_to_end(task_id)
+        self._status.move_to_end(task_id)
+        while len(self._history) > self.max_tasks:
+            self._history.popitem(last=False)
+        while len(self._status) > self.max_tasks:
+            self._status.popitem(last=False)
+
+        if self._deliver is not None:
+            await self._deliver(task_id, message_id, message)
+
+    async def history(self, task_id: str) -> List[Tuple[int, dict]]:
+        return list(self._history.get(task_id, ()))
+
+    async def status(self, task_id: str) -> dict | None:
+        return self._status.get(task_id)
+
+
+class SqliteProgressBus:
+    """
+    Межпроцессная шина на SQLite: публикация — вставка строки в `progress_messages`,
+    подписка — опрос новых строк каждые `poll_interval` секунд.
+    Последний статус задачи хранится в `progress_status`.
+    Сообщения и статусы старше `retention` секунд удаляются.
+    """
+
+    def __init__(self, path: Path, poll_interval: float, retention: float, history_size: int):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.history_size = history_size
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._last_id = 0
+        self._poller: asyncio.Task | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS progress_messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " task_id TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS progress_messages_task ON progress_messages (task_id, id)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS progress_status ("
+                " task_id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            logger.info(f"Progress bus opened: {self.path}")
+        return self._conn
+
+    def _insert(self, task_id: str, message: dict):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO progress_messages (task_id, payload, created_at) VALUES (?, ?, ?)",
+                    (task_id, json.dumps(message, ensure_ascii=False), now)
+                )
+                row = conn.execute("SELECT status FROM progress_status WHERE task_id = ?", (task_id,)).fetchone()
+                status = merge_status(json.loads(row[0]) if row else None, message)
+                conn.execute(
+                    "INSERT OR REPLACE INTO progress_status (task_id, status, updated_at) VALUES (?, ?, ?)",
+                    (task_id, json.dumps(status, ensure_ascii=False), now)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _task_history(self, task_id: str) -> List[Tuple[int, dict]]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, payload FROM progress_messages WHERE task_id = ? ORDER BY id DESC LIMIT ?",
+                (task_id, self.history_size)
+            ).fetchall()
+        return [(message_id, json.loads(payload)) for message_id, payload in reversed(rows)]
+
+    def _task_status(self, task_id: str) -> dict | None:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT status FROM progress_status WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _fetch(self, after_id: int) -> list:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT id, task_id, payload FROM progress_messages WHERE id > ? ORDER BY id", (after_id,)
+            ).fetchall()
+
+    def _last_message_id(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COALESCE(MAX(id), 0) FROM progress_messages").fetchone()[0]
+
+    def _prune(self):
+        expired = time.time() - self.retention
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM progress_messages WHERE created_at < ?", (expired,))
+            conn.execute("DELETE FROM progress_status WHERE updated_at < ?", (expired,))
+
+    async def start(self, deliver: Deliver):
+        self._last_id = await run_in_threadpool(self._last_message_id)
+        self._poller = asyncio.create_task(self._poll(deliver))
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+
+    async def publish(self, task_id: str, message: dict):
+        await run_in_threadpool(self._insert, task_id, message)
+
+    async def history(self, task_id: str) -> List[Tuple[int, dict]]:
+        return await run_in_threadpool(self._task_history, task_id)
+
+    async def status(self, task_id: str) -> dict | None:
+        return await run_in_threadpool(self._task_status, task_id)
+
+    async def _poll(self, deliver: Deliver):
+        pruned_at = time.monotonic()
+        while True:
+            try:
+                for message_id, task_id, payload in await run_in_threadpool(self._fetch, self._last_id):
+                    self._last_id = message_id
+                    await deliver(task_id, message_id, json.loads(payload))
+                if time.monotonic() - pruned_at >= self.retention / 10:
+                    pruned_at = time.monotonic()
+                    await run_in_threadpool(self._prune)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка опроса шины прогресса: {e}")
+            await asyncio.sleep(self.poll_interval)
@@ -1,24 +1,187 @@
-from typing import Dict
+import asyncio
+import time
+from pathlib import Path
+from typing import Dict, Tuple
 from fastapi import WebSocket
 
+from .config import get_settings
+from .logger_setup import logger
+from .progress_bus import LocalProgressBus, SqliteProgressBus
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+def _create_bus():
+    settings = get_settings()
+    if settings.PROGRESS_BUS == "sqlite":
+        return SqliteProgressBus(
+            BASE_DIR / settings.PROGRESS_BUS_PATH,
+            poll_interval=settings.PROGRESS_BUS_POLL_INTERVAL,
+            retention=settings.PROGRESS_BUS_RETENTION,
+            history_size=settings.PROGRESS_HISTORY_SIZE,
+        )
+    return LocalProgressBus(settings.PROGRESS_HISTORY_SIZE, settings.PROGRESS_HISTORY_TASKS)
+
+
+def _is_final(message: dict) -> bool:
+    return message.get("progress") in (100, -1)
+
+
+class _TaskProgress:
+    """Состояние прогресса задачи для объединения частых обновлений."""
+    __slots__ = ("pending", "sent_progress", "sent_at", "flush_handle")
+
+    def __init__(self):
+        self.pending: dict | None = None
+        self.sent_progress = None
+        self.sent_at = 0.0
+        self.flush_handle: asyncio.TimerHandle | None = None
+
+
+class _Connection:
+    """WebSocket клиента и id последнего отправленного ему сообщения."""
+    __slots__ = ("websocket", "last_id", "lock")
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.last_id = 0
+        # Повтор истории и живые сообщения не должны перемешиваться
+        self.lock = asyncio.Lock()
+
 
 class ConnectionManager:
+    """
+    WebSocket-соединения и отправка прогресса задач.
+
+    `send_progress` не ждет отправки: сообщения ставятся в очередь и публикуются
+    фоновой задачей. Частые обновления объединяются: сообщение отправляется сразу,
+    если изменился процент, начался новый этап (есть поле `message`) или задача
+    завершилась (100 / -1); остальные — не чаще раза в `PROGRESS_MIN_INTERVAL` секунд,
+    при этом отправляется последнее из накопившихся.
+
+    Клиенту, подключившемуся после начала обработки (или переподключившемуся),
+    сначала отправляется сохраненная история сообщений задачи.
+    """
+
     def __init__(self):
-        # Словарь для хранения активных соединений: {task_id: websocket_object}
-        self.active_connections: Dict[str, WebSocket] = {}
+        # Словарь для хранения активных соединений: {task_id: connection}
+        self.active_connections: Dict[str, _Connection] = {}
+        # Шина прогресса: задача и WebSocket клиента могут находиться в разных процессах
+        self.bus = _create_bus()
+        self.min_interval = get_settings().PROGRESS_MIN_INTERVAL
+        self._tasks: Dict[str, _TaskProgress] = {}
+        self._outbox: asyncio.Queue[Tuple[str, dict]] | None = None
+        self._sender: asyncio.Task | None = None
+
+    async def start(self):
+        await self.bus.start(self._deliver)
+        self._ensure_sender()
+
+    async def stop(self):
+        if self._sender is not None:
+            # Доотправляем накопленное, но не ждем бесконечно
+            for state in self._tasks.values():
+                if state.flush_handle is not None:
+                    state.flush_handle.cancel()
+            for task_id in list(self._tasks):
+                self._flush(task_id)
+            try:
+                await asyncio.wait_for(self._outbox.join(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+            self._sender, self._outbox = None, None
+        await self.bus.stop()
 
     async def connect(self, websocket: WebSocket, task_id: str):
         await websocket.accept()
-        self.active_connections[task_id] = websocket
+        connection = _Connection(websocket)
+        self.active_connections[task_id] = connection
+        async with connection.lock:
+            for message_id, message in await self.bus.history(task_id):
+                await self._send(task_id, connection, message_id, message)
 
-    def disconnect(self, task_id: str):
-        if task_id in self.active_connections:
+    def disconnect(self, task_id: str, websocket: WebSocket | None = None):
+        connection = self.active_connections.get(task_id)
+        if connection is not None and (websocket is None or connection.websocket is websocket):
             del self.active_connections[task_id]
 
+    async def get_status(self, task_id: str) -> dict | None:
+        """Последний статус задачи (процент, этап, detail) или None, если сообщений не было."""
+        return await self.bus.status(task_id)
+
     async def send_progress(self, task_id: str, message: dict):
-        if task_id in self.active_connections:
-            websocket = self.active_connections[task_id]
-            await websocket.send_json(message)
+        self._ensure_sender()
+        state = self._tasks.setdefault(task_id, _TaskProgress())
+
+        if _is_final(message) or "message" in message:
+            # Накопленное обновление отправляем первым, чтобы сохранить порядок
+            self._flush(task_id)
+            self._enqueue(task_id, state, message)
+            if _is_final(message):
+                del self._tasks[task_id]
+            return
+
+        state.pending = message
+        elapsed = time.monotonic() - state.sent_at
+        if message.get("progress") != state.sent_progress or elapsed >= self.min_interval:
+            self._flush(task_id)
+        elif state.flush_handle is None:
+            state.flush_handle = asyncio.get_running_loop().call_later(
+                self.min_interval - elapsed, self._flush, task_id
+            )
+
+    def _flush(self, task_id: str):
+        state = self._tasks.get(task_id)
+        if state is None:
+            return
+        if state.flush_handle is not None:
+            state.flush_handle.cancel()
+            state.flush_handle = None
+        if state.pending is not None:
+            message, state.pending = state.pending, None
+            self._enqueue(task_id, state, message)
+
+    def _enqueue(self, task_id: str, state: _TaskProgress, message: dict):
+        state.sent_progress = message.get("progress")
+        state.sent_at = time.monotonic()
+        self._outbox.put_nowait((task_id, message))
+
+    def _ensure_sender(self):
+        if self._sender is None or self._sender.done():
+            if self._outbox is None:
+                self._outbox = asyncio.Queue()
+            self._sender = asyncio.create_task(self._send_loop())
+
+    async def _send_loop(self):
+        while True:
+            task_id, message = await self._outbox.get()
+            try:
+                await self.bus.publish(task_id, message)
+            except Exception as e:
+                logger.error(f"[{task_id}] Ошибка публикации прогресса: {e}")
+            finally:
+                self._outbox.task_done()
+
+    async def _deliver(self, task_id: str, message_id: int, message: dict):
+        """Отправляет сообщение клиенту, если он подключен к этому процессу."""
+        connection = self.active_connections.get(task_id)
+        if connection is None:
+            return
+        async with connection.lock:
+            await self._send(task_id, connection, message_id, message)
+
+    async def _send(self, task_id: str, connection: _Connection, message_id: int, message: dict):
+        if message_id <= connection.last_id:
+            return
+        connection.last_id = message_id
+        try:
+            await connection.websocket.send_json(message)
+        except Exception as e:
+            # Оборванное соединение не должно прерывать обработку задачи
+            logger.warning(f"[{task_id}] Не удалось отправить прогресс: {e}")
+            self.disconnect(task_id, connection.websocket)
 
 
 # Один экземпляр менеджера на все приложение
@@ -8,6 +8,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.core import init_gateway_client, shutdown_gateway_client, global_exception_handler
 from app.route import health_router
 from app.route import processing_router
+from app.route import admin_router
+from app.route import metrics_router
+from app.core.websocket_manager import manager
+from app.service.processing.jobs import job_queue
 
 tags_metadata = []
 
@@ -15,7 +19,11 @@ tags_metadata = []
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_gateway_client(app)
+    await manager.start()
+    await job_queue.start(app.state.gateway_client)
     yield
+    await job_queue.stop()
+    await manager.stop()
     await shutdown_gateway_client(app)
 
 
@@ -37,6 +45,8 @@ app.add_middleware(
 
 app.include_router(health_router)
 app.include_router(processing_router)
+app.include_router(admin_router)
+app.include_router(metrics_router)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
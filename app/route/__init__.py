@@ -1,7 +1,11 @@
 from .health import router as health_router
 from .processing import router as processing_router
+from .admin import router as admin_router
+from .metrics import router as metrics_router
 
 __all__ = [
     "health_router",
-    "processing_router"
+    "processing_router",
+    "admin_router",
+    "metrics_router"
 ]
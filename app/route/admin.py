@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.core.dependencies import get_api_key
+from app.service import gateway_control
+from app.service.processing.cache import CACHES, get_cache_stats, clear_caches
+
+router = APIRouter(prefix="/api/admin", tags=["Administration"], dependencies=[Depends(get_api_key)])
+
+
+@router.get("/cache", summary="Статистика кешей справочных запросов")
+async def cache_stats():
+    return get_cache_stats()
+
+
+@router.delete("/cache", summary="Сброс кешей справочных запросов")
+async def flush_cache(name: str | None = Query(None, description="Имя кеша; если не указано, сбрасываются все")):
+    if name is not None and name not in CACHES:
+        raise HTTPException(status_code=404, detail=f"Кеш '{name}' не найден.")
+    return {"flushed": clear_caches(name)}
+
+
+@router.get("/gateway", summary="Состояние и счетчики обращений к шлюзу")
+async def gateway_stats():
+    return gateway_control.get_status()
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.service import gateway_control, metrics
+from app.service.processing.cache import get_cache_stats
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", summary="Метрики процесса в формате Prometheus", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.render_prometheus(get_cache_stats(), gateway_control.get_status()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
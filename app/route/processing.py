@@ -1,145 +1,42 @@
 import uuid
 import shutil
-from pathlib import Path
 from fastapi import (
     APIRouter, UploadFile, File, WebSocket, WebSocketDisconnect,
-    BackgroundTasks, HTTPException, Depends, Query, status
+    Request, HTTPException, Depends, Query, status
 )
 from fastapi.responses import FileResponse
 from starlette.concurrency import run_in_threadpool
 
-from app.core.exceptions import GatewayConnectivityError
 from app.core.dependencies import get_api_key
 from app.core.websocket_manager import manager
 from app.core.config import get_settings
-from app.core.logger_setup import logger
-from app.core import get_gateway_service
-from app.service.processing.getter import (
-    get_raw_data,
-    get_ids,
-    get_test_data_from_evmias,
-    get_person_tests_history,
-    get_pay_type, get_medical_history
-)
-from app.service.processing.sanitizer import (
-    sanitize_raw_data,
-    sanitize_persons_tests_history,
-    sanitize_for_report
-)
-from app.service.processing.tool import (
-    # analyze_person_ids,
-    # doubles_and_not_found,
-    save_json,
-    make_report
-)
-
-from app.service.gateway import GatewayService
+from app.service.processing.pipeline import UPLOADS_DIR, RESULTS_DIR
+from app.service.processing.jobs import job_queue
 
 router = APIRouter(prefix="/api/processing", tags=["Data Processing"])
 settings = get_settings()
 
-BASE_DIR = Path(__file__).resolve().parent.parent.parent
-UPLOADS_DIR = BASE_DIR / "materials" / "uploads"
-RESULTS_DIR = BASE_DIR / "materials" / "results"
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-
 
-async def run_processing_pipeline(task_id: str, input_path: Path, output_path: Path, service: GatewayService):
+def _uploader(request: Request) -> str:
     """
-    pipeline обработки файла.
+    Идентификатор загрузившего файл (для справедливого распределения задач) — IP клиента.
+    За обратным прокси это адрес из X-Forwarded-For, если прокси указан в FORWARDED_ALLOW_IPS.
     """
-    task_results_path = RESULTS_DIR / task_id
-    task_results_path.mkdir(exist_ok=True)
+    return request.client.host if request.client else "unknown"
 
+
+def _validated_task_id(task_id: str) -> str:
+    """ID задачи из URL подставляется в пути и шаблоны glob, поэтому допускаются только UUID."""
     try:
-        await manager.send_progress(task_id, {"progress": 2, "message": "Чтение данных из файла..."})
-        raw_data = await run_in_threadpool(get_raw_data, input_path, settings.START_ROW, settings.MAX_COL)
-        await run_in_threadpool(save_json, raw_data,
-                                task_results_path / "01.raw_data.json")
-
-        await manager.send_progress(task_id, {"progress": 10, "message": "Подготовка данных..."})
-        sanitized_data = await run_in_threadpool(sanitize_raw_data, raw_data)
-        await run_in_threadpool(save_json, sanitized_data,
-                                task_results_path / "02.sanitized_raw_data.json")
-
-        await manager.send_progress(task_id, {"progress": 10, "message": "Поиск ID пациентов в ЕВМИАС..."})
-        persons_ids = await get_ids(
-            service, sanitized_data,
-            task_id=task_id, manager=manager,
-            start_progress=10, end_progress=20
-        )
-        await run_in_threadpool(save_json, persons_ids,
-                                task_results_path / "03.persons_ids.json")
-
-        await manager.send_progress(task_id, {"progress": 20, "message": "Получение данных об услугах из ЕВМИАС ..."})
-        test_data_from_evmias = await get_test_data_from_evmias(
-            service, persons_ids,
-            task_id=task_id, manager=manager,
-            start_progress=20, end_progress=30
-        )
-        await run_in_threadpool(save_json, test_data_from_evmias,
-                                task_results_path / "05.test_data_from_evmias.json")
-
-        await manager.send_progress(task_id, {"progress": 30, "message": "Запрос истории анализов пациентов..."})
-        persons_tests_history = await get_person_tests_history(
-            service, test_data_from_evmias,
-            task_id=task_id, manager=manager,
-            start_progress=30, end_progress=40
-        )
-        await run_in_threadpool(save_json, persons_tests_history, task_results_path / "06.persons_tests_history.json")
-
-        await manager.send_progress(task_id, {"progress": 40, "message": "Очистка данных истории анализов..."})
-        sanitized_persons_tests_history = await run_in_threadpool(sanitize_persons_tests_history, persons_tests_history)
-        await run_in_threadpool(save_json, sanitized_persons_tests_history,
-                                task_results_path / "07.sanitized_persons_tests_history.json")
-
-        await manager.send_progress(task_id, {"progress": 50, "message": "Определение типа оплаты #1..."})
-        records_with_pay_type = await get_pay_type(
-            service, sanitized_persons_tests_history,
-            task_id=task_id, manager=manager,
-            start_progress=50, end_progress=70
-        )
-        await run_in_threadpool(save_json, records_with_pay_type,
-                                task_results_path / "08.pay_type_by_tests_history.json")
-
-        await manager.send_progress(task_id, {"progress": 70, "message": "Определение типа оплаты #2..."})
-        medical_history = await get_medical_history(
-            service, records_with_pay_type,
-            task_id=task_id, manager=manager,
-            start_progress=70, end_progress=90
-        )
-        await run_in_threadpool(save_json, medical_history,
-                                task_results_path / "09.pay_type_by_medical_history.json")
-
-        await manager.send_progress(task_id, {"progress": 90, "message": "Подготовка отчета..."})
-        data_for_report = await run_in_threadpool(sanitize_for_report, medical_history)
-        await run_in_threadpool(save_json, data_for_report,
-                                task_results_path / "10.data_for_report.json")
-
-        await run_in_threadpool(shutil.copy, input_path, output_path)
-        await run_in_threadpool(make_report, data_for_report, output_path)
-
-        download_url = f"/api/processing/download/{task_id}"
-        await manager.send_progress(task_id, {
-            "progress": 100, "message": "Отчет готов к скачиванию!", "download_url": download_url
-        })
-
-    except GatewayConnectivityError as e:
-        await manager.send_progress(task_id, {"progress": -1, "message": str(e)})
-
-    except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        logger.error(f"ОШИБКА в задаче {task_id}: {e}, trace: {error_details}")
-        await manager.send_progress(task_id, {"progress": -1, "message": f"Произошла критическая ошибка: {e}"})
+        return str(uuid.UUID(task_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Задача не найдена.")
 
 
 @router.post("/upload", summary="Загрузка файла и запуск обработки")
 async def upload_and_process(
-        background_tasks: BackgroundTasks,
+        request: Request,
         file: UploadFile = File(...),
-        service: GatewayService = Depends(get_gateway_service),
         api_key: str = Depends(get_api_key)
 ):
     if not file.filename.endswith('.xlsx'):
@@ -152,11 +49,57 @@ async def upload_and_process(
     with open(input_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
 
-    background_tasks.add_task(run_processing_pipeline, task_id, input_path, output_path, service)
+    await job_queue.submit(task_id, _uploader(request), file.filename, input_path, output_path)
+
+    return {"task_id": task_id}
+
+
+@router.post("/resume/{task_id}", summary="Возобновление обработки с последней контрольной точки")
+async def resume_processing(
+        task_id: str,
+        request: Request,
+        api_key: str = Depends(get_api_key)
+):
+    task_id = _validated_task_id(task_id)
+    task_results_path = RESULTS_DIR / task_id
+    input_paths = list(UPLOADS_DIR.glob(f"{task_id}_*"))
+    if not task_results_path.is_dir() or not input_paths:
+        raise HTTPException(status_code=404, detail="Задача не найдена.")
 
+    output_path = RESULTS_DIR / f"{task_id}_report.xlsx"
+    filename = input_paths[0].name.removeprefix(f"{task_id}_")
+    queued = await job_queue.submit(
+        task_id, _uploader(request), filename, input_paths[0], output_path, resume=True
+    )
+    if not queued:
+        raise HTTPException(status_code=409, detail="Задача уже в очереди или выполняется.")
     return {"task_id": task_id}
 
 
+@router.get("/jobs", summary="Список задач обработки")
+async def list_jobs(
+        state: str | None = Query(None, description="queued | running | done | failed"),
+        limit: int = Query(100, ge=1, le=1000),
+        api_key: str = Depends(get_api_key)
+):
+    jobs = await run_in_threadpool(job_queue.store.list, state, limit)
+    return [job.as_dict() for job in jobs]
+
+
+@router.get("/status/{task_id}", summary="Текущий статус задачи (для опроса без WebSocket)")
+async def task_status(task_id: str, api_key: str = Depends(get_api_key)):
+    job = await run_in_threadpool(job_queue.store.get, task_id)
+    progress = await manager.get_status(task_id)
+    if job is None and progress is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена.")
+    return {
+        "task_id": task_id,
+        "state": job.state if job else None,
+        "error": job.error if job else None,
+        **(progress or {}),
+    }
+
+
 @router.websocket("/ws/{task_id}")
 async def websocket_endpoint(
         websocket: WebSocket,
@@ -172,12 +115,12 @@ async def websocket_endpoint(
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(task_id)
+        manager.disconnect(task_id, websocket)
 
 
 @router.get("/download/{task_id}", summary="Скачивание обработанного файла")
 async def download_result(task_id: str, api_key: str = Depends(get_api_key)):
-    file_path = RESULTS_DIR / f"{task_id}_report.xlsx"
+    file_path = RESULTS_DIR / f"{_validated_task_id(task_id)}_report.xlsx"
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="Файл не найден или еще не готов.")
     return FileResponse(path=file_path, filename="report.xlsx")
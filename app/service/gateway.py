@@ -1,8 +1,13 @@
+import asyncio
+import time
+
 import httpx
 from fastapi import HTTPException
 
 from app.core import get_settings, logger
 from app.core.exceptions import GatewayConnectivityError
+from app.service import gateway_control, metrics
+from app.service.projection import Projection, parse_response
 
 
 class GatewayService:
@@ -13,11 +18,22 @@ class GatewayService:
     def __init__(self, client: httpx.AsyncClient):
         self._client = client
 
-    async def make_request(self, method: str, **kwargs) -> dict | None:
+    async def make_request(
+            self, method: str, idempotent: bool = True, projection: Projection = None, **kwargs
+    ) -> dict | None:
         """
         Выполняет HTTP-запрос к единственному эндпоинту шлюза.
 
+        Запросы проходят через общий для процесса ограничитель частоты.
+        Идемпотентные запросы (только чтение данных) при ошибках сети, 5xx и 429
+        повторяются с экспоненциальной задержкой, учитывая заголовок `Retry-After`.
+        Запрос, отклоненный открытым circuit breaker (он не отправлялся), ждет пробного
+        запроса не дольше `GATEWAY_BREAKER_WAIT_MAX` секунд.
+
         :param method: HTTP метод ('get', 'post', 'put', etc.).
+        :param idempotent: Запрос только читает данные, его можно безопасно повторить.
+        :param projection: Поля ответа, которые нужно оставить (см. `app/service/projection.py`);
+                           None — ответ возвращается целиком.
         :param kwargs: Аргументы, которые будут переданы в httpx клиент.
                        Например: json=payload, params=query_params, headers=headers.
         """
@@ -36,29 +52,119 @@ class GatewayService:
         # Обновляем kwargs окончательным набором заголовков
         kwargs['headers'] = base_headers
 
+        rate_limiter = gateway_control.get_rate_limiter(self._client.base_url.host)
+        breaker = gateway_control.circuit_breaker
+        attempts = 1 + (self.settings.GATEWAY_RETRY_ATTEMPTS if idempotent else 0)
+        attempt = 0
+        breaker_waited = 0.0
+
+        while True:
+            is_last_attempt = attempt == attempts - 1
+
+            waited = await rate_limiter.acquire()
+            if waited:
+                gateway_control.stats.throttled += 1
+                gateway_control.stats.throttle_seconds += waited
+
+            gateway_control.stats.requests += 1
+            try:
+                if not hasattr(self._client, method.lower()):
+                    raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
+
+                http_method_func = getattr(self._client, method.lower())
+                response = await self._send(http_method_func, kwargs)
+                response.raise_for_status()
+                metrics.record_response(len(response.content))
+                return parse_response(response.content, projection)
+
+            except GatewayConnectivityError:
+                # Запрос отклонен circuit breaker: ждем пробного запроса, попытка не расходуется
+                delay = breaker.retry_delay()
+                if breaker_waited + delay <= self.settings.GATEWAY_BREAKER_WAIT_MAX:
+                    breaker_waited += delay
+                    await asyncio.sleep(delay)
+                    continue
+                metrics.record_error()
+                raise
+
+            except ValueError as exc:
+                logger.exception(f"Внутренняя ошибка сервиса: {exc}")
+                raise HTTPException(status_code=500, detail=str(exc))
+
+            except httpx.HTTPStatusError as exc:
+                status_code = exc.response.status_code
+                if gateway_control.is_retryable_status(status_code) and not is_last_attempt:
+                    await self._wait_before_retry(attempt, exc, rate_limiter)
+                    attempt += 1
+                    continue
+
+                metrics.record_error()
+                if 400 <= status_code < 500:
+                    logger.warning(f"Ошибка от шлюза (4xx): {exc.response.text}")
+                    return None
+
+                gateway_control.stats.failures += 1
+                breaker.record_failure()
+                logger.error(f"Критическая ошибка от шлюза (5xx): {exc}")
+                raise GatewayConnectivityError("API-шлюз ЕВМИАС временно недоступен (ошибка сервера).")
+
+            except httpx.RequestError as exc:
+                if not is_last_attempt:
+                    await self._wait_before_retry(attempt, exc, rate_limiter)
+                    attempt += 1
+                    continue
+
+                gateway_control.stats.failures += 1
+                breaker.record_failure()
+                metrics.record_error()
+                logger.error(f"Критическая ошибка подключения к шлюзу: {exc}")
+                raise GatewayConnectivityError("Не удалось подключиться к API-шлюзу ЕВМИАС (ошибка сети).")
+
+    async def _send(self, http_method_func, kwargs: dict) -> httpx.Response:
+        """
+        Отправляет один запрос через общий circuit breaker и адаптивный лимит
+        одновременных запросов, сообщая им результат и время ответа.
+        Ошибка запроса после всех повторов учитывается breaker в `make_request`.
+        """
+        breaker = gateway_control.circuit_breaker
+        limiter = gateway_control.concurrency_limiter
+
+        breaker.before_request()
+        await limiter.acquire()
+        started = time.monotonic()
+        healthy = False
+        extensions = {**kwargs.get("extensions", {}), "trace": gateway_control.pool_wait_tracer(started)}
         try:
-            if not hasattr(self._client, method.lower()):
-                raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
-
-            http_method_func = getattr(self._client, method.lower())
-            response = await http_method_func(self.GATEWAY_ENDPOINT, **kwargs)
-            response.raise_for_status()
-            return response.json() if response.content else {}
-
-
-        except ValueError as exc:
-            logger.exception(f"Внутренняя ошибка сервиса: {exc}")
-            raise HTTPException(status_code=500, detail=str(exc))
-
-        except httpx.HTTPStatusError as exc:
-            if 400 <= exc.response.status_code < 500:
-                logger.warning(f"Ошибка от шлюза (4xx): {exc.response.text}")
-                return None
-
-            logger.error(f"Критическая ошибка от шлюза (5xx): {exc}")
-            raise GatewayConnectivityError("API-шлюз ЕВМИАС временно недоступен (ошибка сервера).")
-
-        except httpx.RequestError as exc:
-            logger.error(f"Критическая ошибка подключения к шлюзу: {exc}")
-            raise GatewayConnectivityError("Не удалось подключиться к API-шлюзу ЕВМИАС (ошибка сети).")
-
+            response = await http_method_func(self.GATEWAY_ENDPOINT, **{**kwargs, "extensions": extensions})
+        except httpx.RequestError:
+            breaker.record_attempt_failure()
+            raise
+        except BaseException:
+            breaker.record_cancelled()
+            raise
+        else:
+            healthy = not gateway_control.is_retryable_status(response.status_code)
+            if response.status_code >= 500:
+                breaker.record_attempt_failure()
+            else:
+                breaker.record_success()
+            return response
+        finally:
+            await limiter.release(time.monotonic() - started, healthy)
+
+    @staticmethod
+    async def _wait_before_retry(attempt: int, exc: httpx.HTTPError, rate_limiter):
+        delay = None
+        if isinstance(exc, httpx.HTTPStatusError):
+            delay = gateway_control.retry_after_delay(exc.response)
+        if delay is not None:
+            # Шлюз сам попросил подождать: притормаживаем все запросы к нему
+            gateway_control.stats.retry_after += 1
+            rate_limiter.pause(delay)
+        else:
+            delay = gateway_control.backoff_delay(attempt)
+
+        gateway_control.stats.retries += 1
+        gateway_control.stats.backoff_seconds += delay
+        logger.warning(f"Повтор запроса к шлюзу через {delay:.2f} с (попытка {attempt + 2}): {exc!r}")
+        await asyncio.sleep(delay)
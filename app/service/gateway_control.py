@@ -0,0 +1,300 @@
+"""
+Управление нагрузкой на шлюз ЕВМИАС: ограничение частоты запросов (token bucket),
+повторы с экспоненциальной задержкой, автоматический выключатель (circuit breaker),
+адаптивный (AIMD) лимит одновременных запросов и счетчики.
+
+Состояние общее для всего процесса: `GatewayService` создается на каждый HTTP-запрос,
+а лимиты должны действовать для всех задач одновременно.
+"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict
+
+import httpx
+
+from app.core.config import get_settings
+from app.core.exceptions import GatewayConnectivityError
+from app.core.logger_setup import logger
+
+settings = get_settings()
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов: `rate` запросов в секунду с допустимым всплеском `burst`.
+    При `rate <= 0` ограничение выключено.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов (например, по заголовку `Retry-After`)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> float:
+        """Ожидает разрешения на запрос. Возвращает время ожидания в секундах."""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                delay = self._paused_until - now
+                if delay <= 0 and self.rate <= 0:
+                    return waited
+                if delay <= 0:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class GatewayStats:
+    """Счетчики обращений к шлюзу."""
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.retry_after = 0
+        self.backoff_seconds = 0.0
+        self.pool_waits = 0
+        self.pool_wait_seconds = 0.0
+        self.pool_wait_max = 0.0
+
+    def record_pool_wait(self, seconds: float):
+        self.pool_waits += 1
+        self.pool_wait_seconds += seconds
+        self.pool_wait_max = max(self.pool_wait_max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "throttled": self.throttled,
+            "throttle_seconds": round(self.throttle_seconds, 3),
+            "retry_after": self.retry_after,
+            "backoff_seconds": round(self.backoff_seconds, 3),
+            "pool_wait": {
+                "count": self.pool_waits,
+                "avg_seconds": round(self.pool_wait_seconds / self.pool_waits, 4) if self.pool_waits else 0.0,
+                "max_seconds": round(self.pool_wait_max, 4),
+            },
+        }
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для шлюза.
+
+    closed    — запросы проходят, считаются подряд идущие ошибки;
+    open      — после `failure_threshold` ошибок (запросов, не выполненных и после повторов)
+                запросы сразу отклоняются в течение `reset_timeout` секунд;
+    half_open — по истечении таймаута пропускается один пробный запрос:
+                успех закрывает выключатель, ошибка снова его открывает.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    # Интервал (сек.), с которым отклоненные запросы проверяют, завершился ли пробный запрос
+    PROBE_POLL_INTERVAL = 0.2
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def before_request(self):
+        """Проверяет, можно ли отправить запрос; иначе выбрасывает `GatewayConnectivityError`."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("Circuit breaker шлюза: half-open, пробный запрос")
+
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+
+        self.rejected += 1
+        raise GatewayConnectivityError("API-шлюз ЕВМИАС временно недоступен (запросы приостановлены после серии ошибок).")
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit breaker шлюза: closed, шлюз снова отвечает")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_cancelled(self):
+        """Запрос не завершился (отменен): освобождаем место пробного запроса."""
+        self._probe_in_flight = False
+
+    def record_attempt_failure(self):
+        """
+        Неудачная попытка, после которой запрос еще может быть повторен: в счетчик ошибок
+        не идет, но неудачный пробный запрос (half-open) снова открывает выключатель.
+        """
+        if self.state == self.HALF_OPEN:
+            self.record_failure()
+
+    def record_failure(self):
+        """Запрос не выполнен и после всех повторов."""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit breaker шлюза: open на {self.reset_timeout} с после {self.failures} ошибок")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def retry_delay(self) -> float:
+        """Через сколько секунд имеет смысл повторить отклоненный запрос."""
+        if self.state == self.OPEN:
+            return max(self.PROBE_POLL_INTERVAL, self.opened_at + self.reset_timeout - time.monotonic())
+        # Пробный запрос еще выполняется
+        return self.PROBE_POLL_INTERVAL
+
+    def as_dict(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Адаптивный лимит одновременных запросов (AIMD).
+
+    Каждый успешный ответ быстрее `latency_target` увеличивает лимит на 1/limit
+    (в среднем +1 за «окно» из limit запросов). Ошибка или медленный ответ
+    уменьшает лимит в `decrease_factor` раз, но не чаще одного раза за `latency_target`,
+    чтобы одна волна медленных ответов не обрушила лимит до минимума.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float, decrease_factor: float):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._decreased_at = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, ok: bool):
+        async with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.latency_target:
+                if now - self._decreased_at >= self.latency_target:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._decreased_at = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def as_dict(self) -> dict:
+        return {"limit": int(self.limit), "in_flight": self.in_flight}
+
+
+stats = GatewayStats()
+_rate_limiters: Dict[str, TokenBucket] = {}
+circuit_breaker = CircuitBreaker(settings.GATEWAY_BREAKER_FAILURE_THRESHOLD, settings.GATEWAY_BREAKER_RESET_TIMEOUT)
+concurrency_limiter = AdaptiveConcurrencyLimiter(
+    initial=settings.GATEWAY_CONCURRENCY_INITIAL,
+    minimum=settings.GATEWAY_CONCURRENCY_MIN,
+    maximum=settings.GATEWAY_CONCURRENCY_MAX,
+    latency_target=settings.GATEWAY_LATENCY_TARGET,
+    decrease_factor=settings.GATEWAY_CONCURRENCY_DECREASE_FACTOR,
+)
+
+
+def get_rate_limiter(host: str) -> TokenBucket:
+    """Ограничитель частоты для хоста шлюза (один на процесс)."""
+    if host not in _rate_limiters:
+        _rate_limiters[host] = TokenBucket(settings.GATEWAY_RATE_LIMIT_RPS, settings.GATEWAY_RATE_LIMIT_BURST)
+    return _rate_limiters[host]
+
+
+# События httpcore, означающие, что запрос получил соединение из пула:
+# открытие нового соединения или отправка запроса в уже открытое
+_POOL_ACQUIRED_EVENTS = {
+    "connection.connect_tcp.started",
+    "connection.connect_unix_socket.started",
+    "http11.send_request_headers.started",
+    "http2.send_request_headers.started",
+}
+
+
+def pool_wait_tracer(started: float):
+    """
+    Callback для расширения `trace` httpx: фиксирует время ожидания соединения
+    в пуле (от начала запроса до получения соединения).
+    """
+    recorded = False
+
+    async def trace(event_name: str, info: dict):
+        nonlocal recorded
+        if not recorded and event_name in _POOL_ACQUIRED_EVENTS:
+            recorded = True
+            stats.record_pool_wait(time.monotonic() - started)
+
+    return trace
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером для попытки `attempt` (с 0)."""
+    ceiling = min(settings.GATEWAY_RETRY_BACKOFF_MAX, settings.GATEWAY_RETRY_BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+def retry_after_delay(response: httpx.Response) -> float | None:
+    """Задержка из заголовка `Retry-After` (секунды или HTTP-дата), не больше `GATEWAY_RETRY_AFTER_MAX`."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0.0), settings.GATEWAY_RETRY_AFTER_MAX)
+
+
+def get_status() -> dict:
+    """Сводное состояние управления нагрузкой на шлюз."""
+    return {
+        **stats.as_dict(),
+        "circuit_breaker": circuit_breaker.as_dict(),
+        "concurrency": concurrency_limiter.as_dict(),
+    }
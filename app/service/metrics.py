@@ -0,0 +1,239 @@
+"""
+Метрики обработки: длительность этапов pipeline и запросов `fetch_*` к шлюзу,
+число вызовов, ошибок, попаданий в кеш и полученных байт.
+
+Метрики собираются на двух уровнях:
+- по задаче (`TaskMetrics`) — сохраняются рядом с контрольными точками в `metrics.json`;
+- по процессу — отдаются в формате Prometheus на `/metrics`.
+
+Текущая задача и текущий `fetch_*` передаются через ContextVar, поэтому
+`GatewayService` и кеши не знают, в рамках какой задачи выполняется запрос.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Iterator
+
+# Границы корзин гистограмм длительности (сек.)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+
+
+class FetchMetrics:
+    __slots__ = ("calls", "errors", "seconds", "bytes", "cache_hits", "cache_misses")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "avg_seconds": round(self.seconds / self.calls, 4) if self.calls else 0.0,
+            "bytes": self.bytes,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+class TaskMetrics:
+    """Метрики одной задачи."""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.started_at = time.time()
+        self.stages: Dict[str, float] = {}
+        self.fetches: Dict[str, FetchMetrics] = {}
+
+    def fetch(self, name: str) -> FetchMetrics:
+        if name not in self.fetches:
+            self.fetches[name] = FetchMetrics()
+        return self.fetches[name]
+
+    def as_dict(self) -> dict:
+        return {
+            "task_id": self.task_id,
+            "started_at": self.started_at,
+            "total_seconds": round(time.time() - self.started_at, 3),
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "fetches": {name: fetch.as_dict() for name, fetch in sorted(self.fetches.items())},
+        }
+
+
+class ProcessMetrics:
+    """Накопительные метрики процесса для `/metrics`."""
+
+    def __init__(self):
+        self.stage_durations: Dict[str, Histogram] = {}
+        self.fetch_durations: Dict[str, Histogram] = {}
+        self.fetches: Dict[str, FetchMetrics] = {}
+        self.tasks = {"done": 0, "failed": 0}
+
+    def fetch(self, name: str) -> FetchMetrics:
+        if name not in self.fetches:
+            self.fetches[name] = FetchMetrics()
+        return self.fetches[name]
+
+
+process_metrics = ProcessMetrics()
+_task_metrics: ContextVar[TaskMetrics | None] = ContextVar("task_metrics", default=None)
+_current_fetch: ContextVar[str | None] = ContextVar("current_fetch", default=None)
+
+
+@contextmanager
+def task_metrics(task_id: str) -> Iterator[TaskMetrics]:
+    """Собирает метрики задачи для всего, что выполняется внутри блока (и в порожденных задачах)."""
+    metrics = TaskMetrics(task_id)
+    token = _task_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _task_metrics.reset(token)
+
+
+def _fetch_targets(name: str) -> list:
+    targets = [process_metrics.fetch(name)]
+    metrics = _task_metrics.get()
+    if metrics is not None:
+        targets.append(metrics.fetch(name))
+    return targets
+
+
+def record_stage(stage: str, seconds: float):
+    metrics = _task_metrics.get()
+    if metrics is not None:
+        metrics.stages[stage] = metrics.stages.get(stage, 0.0) + seconds
+    process_metrics.stage_durations.setdefault(stage, Histogram()).observe(seconds)
+
+
+def record_task_result(ok: bool):
+    process_metrics.tasks["done" if ok else "failed"] += 1
+
+
+def record_cache(name: str, hit: bool):
+    for target in _fetch_targets(name):
+        if hit:
+            target.cache_hits += 1
+        else:
+            target.cache_misses += 1
+
+
+def record_response(size: int):
+    """Ответ шлюза на запрос текущего `fetch_*`."""
+    name = _current_fetch.get() or "other"
+    for target in _fetch_targets(name):
+        target.bytes += size
+
+
+def record_error():
+    """Ошибка запроса к шлюзу в рамках текущего `fetch_*`."""
+    name = _current_fetch.get() or "other"
+    for target in _fetch_targets(name):
+        target.errors += 1
+
+
+def instrumented(name: str):
+    """
+    Декоратор для `fetch_*`: считает вызовы и длительность, а также связывает
+    с этим `fetch_*` байты и ошибки, которые фиксирует `GatewayService`.
+    Ставится под `@cached`, т.е. учитывает только фактические обращения к шлюзу.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _current_fetch.set(name)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - started
+                _current_fetch.reset(token)
+                for target in _fetch_targets(name):
+                    target.calls += 1
+                    target.seconds += seconds
+                process_metrics.fetch_durations.setdefault(name, Histogram()).observe(seconds)
+        return wrapper
+    return decorator
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    values = ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels.items())
+    return "{" + values + "}"
+
+
+def _histogram_lines(metric: str, label: str, histograms: Dict[str, Histogram]) -> list:
+    lines = [f"# TYPE {metric} histogram"]
+    for name, histogram in sorted(histograms.items()):
+        for bound, count in zip(DURATION_BUCKETS, histogram.buckets):
+            lines.append(f"{metric}_bucket{_labels(**{label: name, 'le': bound})} {count}")
+        lines.append(f"{metric}_bucket{_labels(**{label: name, 'le': '+Inf'})} {histogram.count}")
+        lines.append(f"{metric}_sum{_labels(**{label: name})} {histogram.sum:.6f}")
+        lines.append(f"{metric}_count{_labels(**{label: name})} {histogram.count}")
+    return lines
+
+
+def render_prometheus(cache_stats: dict, gateway_status: dict) -> str:
+    """Метрики процесса в текстовом формате Prometheus."""
+    lines = _histogram_lines("invitro_stage_duration_seconds", "stage", process_metrics.stage_durations)
+    lines += _histogram_lines("invitro_fetch_duration_seconds", "fetch", process_metrics.fetch_durations)
+
+    fetch_counters = [
+        ("invitro_fetch_calls_total", "calls"),
+        ("invitro_fetch_errors_total", "errors"),
+        ("invitro_fetch_bytes_received_total", "bytes"),
+    ]
+    for metric, attribute in fetch_counters:
+        lines.append(f"# TYPE {metric} counter")
+        for name, fetch in sorted(process_metrics.fetches.items()):
+            lines.append(f"{metric}{_labels(fetch=name)} {getattr(fetch, attribute)}")
+
+    lines.append("# TYPE invitro_tasks_total counter")
+    for result, count in process_metrics.tasks.items():
+        lines.append(f"invitro_tasks_total{_labels(result=result)} {count}")
+
+    cache_counters = [
+        ("invitro_cache_hits_total", "hits"),
+        ("invitro_cache_misses_total", "misses"),
+        ("invitro_cache_size", "size"),
+    ]
+    for metric, key in cache_counters:
+        lines.append(f"# TYPE {metric} {'gauge' if key == 'size' else 'counter'}")
+        for name, stats in sorted(cache_stats.items()):
+            lines.append(f"{metric}{_labels(cache=name)} {stats[key]}")
+
+    gateway_counters = ["requests", "retries", "failures", "throttled", "retry_after"]
+    for key in gateway_counters:
+        lines.append(f"# TYPE invitro_gateway_{key}_total counter")
+        lines.append(f"invitro_gateway_{key}_total {gateway_status[key]}")
+    breaker = gateway_status["circuit_breaker"]
+    lines.append("# TYPE invitro_gateway_circuit_open gauge")
+    lines.append(f"invitro_gateway_circuit_open {int(breaker['state'] != 'closed')}")
+    lines.append("# TYPE invitro_gateway_concurrency_limit gauge")
+    lines.append(f"invitro_gateway_concurrency_limit {gateway_status['concurrency']['limit']}")
+    lines.append("# TYPE invitro_gateway_in_flight gauge")
+    lines.append(f"invitro_gateway_in_flight {gateway_status['concurrency']['in_flight']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,209 @@
+"""
+Процессные кеши справочных запросов к ЕВМИАС.
+
+В отличие от `alru_cache`, ключ кеша строится только по доменным аргументам
+(код услуги, person_id, event_id и т.д.), без экземпляра `GatewayService`,
+поэтому кеш переживает отдельные запросы и задачи.
+Для части кешей может быть включен второй, персистентный уровень (SQLite),
+см. `persistent_cache.py` и настройку `CACHE_PERSISTENT_ENABLED`.
+"""
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+from functools import partial, wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+from app.service import metrics
+from .persistent_cache import PersistentCacheStore
+
+settings = get_settings()
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
+
+_persistent_store: PersistentCacheStore | None = None
+
+
+def _is_not_none(value: Any) -> bool:
+    return value is not None
+
+
+class LookupCache:
+    """LRU-кеш с ограничением по размеру, временем жизни записей и счетчиками."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int, persistent_ttl: float | None = None):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.persistent_ttl = persistent_ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+
+    @property
+    def store(self) -> PersistentCacheStore | None:
+        """Персистентный уровень кеша, если он включен для этого кеша и в настройках."""
+        if self.persistent_ttl is None:
+            return None
+        return get_persistent_store()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Возвращает (найдено, значение). Просроченные записи удаляются."""
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._data[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        if self.store is not None:
+            self.store.clear(self.name)
+
+    def stats(self) -> dict:
+        stats = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+        if self.store is not None:
+            stats["persistent"] = {
+                "size": self.store.size(self.name),
+                "maxsize": self.store.maxsize,
+                "ttl": self.persistent_ttl,
+                "hits": self.persistent_hits,
+            }
+        return stats
+
+
+def get_persistent_store() -> PersistentCacheStore | None:
+    global _persistent_store
+    if not settings.CACHE_PERSISTENT_ENABLED:
+        return None
+    if _persistent_store is None:
+        _persistent_store = PersistentCacheStore(
+            BASE_DIR / settings.CACHE_PERSISTENT_PATH, settings.CACHE_PERSISTENT_MAXSIZE
+        )
+    return _persistent_store
+
+
+# Все кеши процесса: {имя: кеш}
+CACHES: Dict[str, LookupCache] = {}
+
+
+def cached(
+        name: str, ttl: float, maxsize: int,
+        should_cache: Callable[[Any], bool] = _is_not_none,
+        persistent_ttl: float | None = None,
+        should_persist: Callable[[Any], bool] | None = None,
+        ttl_for: Callable[[Any], float | None] | None = None
+):
+    """
+    Декоратор для функций вида `fetch_*(service, *args)`.
+    Первый аргумент (сервис) в ключ кеша не входит.
+    Результаты, для которых `should_cache` вернул False (ошибки, пустые ответы), не кешируются.
+    Одновременные вызовы с одинаковым ключом объединяются в один запрос к шлюзу.
+
+    Если задан `persistent_ttl`, результаты дополнительно сохраняются в персистентный
+    кеш (когда он включен в настройках); `should_persist` позволяет сохранять только часть из них.
+    `ttl_for` задает время жизни в процессном кеше в зависимости от значения
+    (None — `ttl`), например, короткое для отрицательных результатов.
+    """
+    cache = CACHES[name] = LookupCache(name, ttl, maxsize, persistent_ttl)
+    should_persist = should_persist or should_cache
+
+    async def _remember(key, value):
+        if should_cache(value):
+            cache.set(key, value, ttl_for(value) if ttl_for is not None else None)
+            store = cache.store
+            if store is not None and should_persist(value):
+                await run_in_threadpool(store.set, name, key, value, persistent_ttl)
+
+    async def _load(func, args, kwargs, key):
+        store = cache.store
+        if store is not None:
+            found, value = await run_in_threadpool(store.get, name, key)
+            if found:
+                cache.persistent_hits += 1
+                metrics.record_cache(name, hit=True)
+                cache.set(key, value)
+                return value
+
+        metrics.record_cache(name, hit=False)
+        value = await func(*args, **kwargs)
+        await _remember(key, value)
+        return value
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        in_flight: Dict[Hashable, asyncio.Task] = {}
+
+        def _forget(key, task: asyncio.Task):
+            if in_flight.get(key) is task:
+                del in_flight[key]
+            if not task.cancelled():
+                # Ошибку получают ожидающие вызовы; гасим предупреждение, если их не осталось
+                task.exception()
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            key = tuple(bound.arguments.values())[1:]
+            found, value = cache.get(key)
+            if found:
+                metrics.record_cache(name, hit=True)
+                return value
+
+            task = in_flight.get(key)
+            if task is not None:
+                metrics.record_cache(name, hit=True)
+            else:
+                # Загрузка идет отдельной задачей: отмена вызова, который ее начал (например,
+                # при отмене его задачи обработки), не отменяет ожидающие вызовы других задач
+                task = in_flight[key] = asyncio.ensure_future(_load(func, args, kwargs, key))
+                task.add_done_callback(partial(_forget, key))
+            return await asyncio.shield(task)
+
+        async def prime(*args, value, **kwargs):
+            """Сохраняет в кеш значение, полученное в обход функции (например, пакетным запросом)."""
+            bound = signature.bind(*args, **kwargs)
+            await _remember(tuple(bound.arguments.values())[1:], value)
+
+        wrapper.cache = cache
+        wrapper.prime = prime
+        return wrapper
+
+    return decorator
+
+
+def get_cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+def clear_caches(name: str | None = None) -> list[str]:
+    """Очищает один кеш по имени или все кеши. Возвращает имена очищенных кешей."""
+    names = [name] if name else list(CACHES)
+    for each in names:
+        CACHES[each].clear()
+    return names
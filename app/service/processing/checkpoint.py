@@ -0,0 +1,117 @@
+"""
+Запись контрольных точек pipeline.
+
+`CHECKPOINT_MODE`:
+  off     — контрольные точки не пишутся (возобновленная задача начинается сначала,
+            повторные запросы к шлюзу попадают в кеш);
+  compact — компактный JSON, по `CHECKPOINT_COMPRESSION` сжатый gzip или zstd;
+  full    — JSON с отступами, как раньше (удобно для отладки).
+
+Этапы изменяют строки на месте, поэтому сериализация выполняется сразу после этапа
+(в пуле потоков), а сжатие и запись на диск — в фоне, параллельно со следующим этапом.
+Файл пишется во временный и переименовывается, чтобы при сбое не осталось
+недописанной контрольной точки.
+"""
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import List
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+from app.core.logger_setup import logger
+from .tool import dump_json_bytes, compress_bytes, orjson, zstandard
+
+settings = get_settings()
+
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _compression() -> str:
+    compression = settings.CHECKPOINT_COMPRESSION if settings.CHECKPOINT_MODE == "compact" else "none"
+    if compression == "zstd" and zstandard is None:
+        logger.warning("CHECKPOINT_COMPRESSION=zstd, но пакет zstandard не установлен: используется gzip")
+        return "gzip"
+    return compression if compression in COMPRESSION_SUFFIXES else "none"
+
+
+def find_checkpoint(path: Path) -> Path | None:
+    """
+    Файл контрольной точки с учетом возможного сжатия или None.
+    Сжатые zstd файлы без установленного пакета zstandard не читаются и пропускаются
+    (задача продолжится с более ранней контрольной точки).
+    """
+    for suffix in COMPRESSION_SUFFIXES.values():
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists():
+            if suffix == COMPRESSION_SUFFIXES["zstd"] and zstandard is None:
+                logger.warning(f"Контрольная точка {candidate.name} пропущена: пакет zstandard не установлен")
+                continue
+            return candidate
+    return None
+
+
+def remove_checkpoint(path: Path):
+    for suffix in COMPRESSION_SUFFIXES.values():
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def _write_file(payload: bytes, compression: str, path: Path) -> int:
+    data = compress_bytes(payload, compression)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+class CheckpointWriter:
+    """Контрольные точки одной задачи."""
+
+    def __init__(self, task_id: str, directory: Path):
+        self.task_id = task_id
+        self.directory = directory
+        self.enabled = settings.CHECKPOINT_MODE != "off"
+        self.pretty = settings.CHECKPOINT_MODE == "full"
+        self.compression = _compression()
+        self._pending: List[asyncio.Task] = []
+
+    async def save(self, data, name: str, wait: bool = False, replaces: str | None = None):
+        """
+        Сохраняет контрольную точку `name`. Запись на диск выполняется в фоне,
+        при `wait=True` (частичный результат при ошибке) — дожидается ее.
+        Контрольная точка `replaces` удаляется после записи.
+        """
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        payload = await run_in_threadpool(dump_json_bytes, data, self.pretty)
+        serialized = time.perf_counter() - started
+
+        path = self.directory / (name + COMPRESSION_SUFFIXES[self.compression])
+        replaced = self.directory / replaces if replaces else None
+        task = asyncio.create_task(self._write(payload, path, serialized, replaced))
+        self._pending.append(task)
+        if wait:
+            await task
+
+    async def _write(self, payload: bytes, path: Path, serialized: float, replaced: Path | None):
+        started = time.perf_counter()
+        # Старая версия с другим сжатием не должна остаться рядом с новой
+        base_path = path.with_name(path.name.removesuffix(COMPRESSION_SUFFIXES[self.compression]))
+        await run_in_threadpool(remove_checkpoint, base_path)
+        size = await run_in_threadpool(_write_file, payload, self.compression, path)
+        if replaced is not None:
+            await run_in_threadpool(remove_checkpoint, replaced)
+        logger.info(
+            f"[{self.task_id}] Контрольная точка {path.name}: {size / 1024:.0f} КБ, "
+            f"сериализация {serialized:.3f} с, запись {time.perf_counter() - started:.3f} с"
+            f"{' (orjson)' if orjson is not None else ''}"
+        )
+
+    async def flush(self, raise_errors: bool = True):
+        """Дожидается всех фоновых записей."""
+        pending, self._pending = self._pending, []
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=not raise_errors)
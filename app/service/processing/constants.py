@@ -8,6 +8,14 @@ PERSON_ID_STATUS_NOT_FOUND = '404'
 PERSON_ID_STATUS_MULTIPLE_FOUND = '500'
 PERSON_ID_STATUS_API_ERROR = '503_API_ERROR'
 
+# Типы событий, запрашиваемые в мед. истории (EMK/getPersonHistory)
+MEDICAL_HISTORY_EVN_CLASSES = [
+    "EvnPLDispDop13", "EvnUslugaPar", "EvnDirection", "_EvnLabSample", "EvnPL",
+    "_EvnLabRequest", "EvnVaccination", "CmpCard", "DispRefuse", "ReturnEvnPrescrMse", "OuterRegistry"
+]
+# Типы событий, по которым может быть определен тип оплаты (посещения поликлиники)
+MEDICAL_HISTORY_VISIT_EVN_CLASSES = ["EvnPL"]
+
 PRICE_FORMAT = '0.00'
 
 COMMENT_SERVICE_NOT_FOUND = "Услуга с кодом '{}' не найдена в ЕВМИАС"
@@ -0,0 +1,120 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Sequence
+
+from app.core.config import get_settings
+from app.core.logger_setup import logger
+
+settings = get_settings()
+
+# Общий лимит одновременных вызовов для всех этапов задачи (используется в потоковом режиме,
+# где этапы работают параллельно и локальные лимиты каждого этапа складывались бы)
+_shared_semaphore: ContextVar[asyncio.Semaphore | None] = ContextVar("shared_semaphore", default=None)
+
+
+@contextmanager
+def shared_concurrency_limit(limit: int) -> Iterator[None]:
+    """Все `run_concurrently` внутри блока (и в порожденных задачах) делят один семафор."""
+    token = _shared_semaphore.set(asyncio.Semaphore(limit))
+    try:
+        yield
+    finally:
+        _shared_semaphore.reset(token)
+
+
+async def gather_or_cancel(tasks: Sequence[asyncio.Task]) -> list:
+    """
+    Ожидает все задачи. Если одна из них завершилась ошибкой, остальные отменяются,
+    а исключение пробрасывается дальше.
+    """
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def run_concurrently(
+        items: Sequence,
+        worker: Callable[[Any], Awaitable[Any]],
+        task_id: str, manager,
+        start_progress: int, end_progress: int,
+        detail: str,
+        limit: int | None = None
+) -> list:
+    """
+    Выполняет `worker` для каждого элемента `items`, ограничивая число
+    одновременно выполняемых вызовов (по умолчанию `PROCESSING_CONCURRENCY`).
+
+    Порядок результатов совпадает с порядком `items`. Прогресс отправляется
+    по мере завершения обработки элементов, `detail` — шаблон вида
+    "Обработано {done} из {total}". Без `manager` прогресс не отправляется.
+    Если один из вызовов завершился ошибкой, остальные отменяются,
+    а исключение пробрасывается дальше.
+    """
+    total = len(items)
+    if total == 0:
+        return []
+
+    semaphore = _shared_semaphore.get() or asyncio.Semaphore(limit or settings.PROCESSING_CONCURRENCY)
+    progress_span = end_progress - start_progress
+    done = 0
+
+    async def _run(item):
+        nonlocal done
+        async with semaphore:
+            result = await worker(item)
+
+        done += 1
+        if manager is None:
+            return result
+        current_progress = start_progress + int((done / total) * progress_span)
+        progress_message = {
+            "progress": current_progress,
+            "detail": detail.format(done=done, total=total)
+        }
+        await manager.send_progress(task_id, progress_message)
+        return result
+
+    return await gather_or_cancel([asyncio.create_task(_run(item)) for item in items])
+
+
+async def run_deduplicated(
+        keys: Sequence[Hashable | None],
+        worker: Callable[[Any], Awaitable[Any]],
+        task_id: str, manager,
+        start_progress: int, end_progress: int,
+        detail: str, stage: str,
+        results: Dict[Hashable, Any] | None = None
+) -> Dict[Hashable, Any]:
+    """
+    Вызывает `worker` один раз для каждого уникального ключа из `keys`
+    (ключи `None` пропускаются) и возвращает словарь {ключ: результат}
+    для последующего сопоставления со строками.
+    Словарь `results` заполняется по мере получения ответов, поэтому при ошибке
+    в нем остаются результаты уже обработанных ключей.
+    Статистика уникальных ключей этапа пишется в лог задачи
+    (без `manager`, т.е. при обработке отдельной группы строк, — на уровне DEBUG).
+    """
+    total = sum(1 for key in keys if key is not None)
+    unique_keys = list(dict.fromkeys(key for key in keys if key is not None))
+    logger.log(
+        "INFO" if manager is not None else "DEBUG",
+        f"[{task_id}] {stage}: уникальных ключей {len(unique_keys)} из {total}"
+    )
+
+    results = {} if results is None else results
+
+    async def _run(key):
+        results[key] = await worker(key)
+
+    await run_concurrently(
+        unique_keys, _run,
+        task_id=task_id, manager=manager,
+        start_progress=start_progress, end_progress=end_progress,
+        detail=detail
+    )
+    return results
@@ -1,11 +1,15 @@
 from pathlib import Path
+from typing import Iterator
 from openpyxl import load_workbook
+from app.core.config import get_settings
 from app.core.logger_setup import logger
 from datetime import date, datetime
 from . import constants
 from .pay_type_mapper import PAY_TYPE_IDS
+from .record import Record, is_set
 from .request import (
     fetch_person_id,
+    search_persons,
     fetch_test_data_from_evmias,
     fetch_person_tests_history,
     fetch_test_report,
@@ -15,11 +19,21 @@ from .request import (
 from .sanitizer import (
     sanitize_test_data_from_evmias,
     sanitize_test_info,
-    sanitize_medical_history
+    MedicalHistoryIndex
 )
+from .executor import run_deduplicated
 from app.service.gateway import GatewayService
 from app.service.processing.tool import is_person_id_valid
 
+settings = get_settings()
+
+# Поля ФИО в строках грида поиска пациентов (с запасными вариантами названий)
+PERSON_GRID_NAME_FIELDS = (
+    ("Person_Surname", "PersonSurName_SurName"),
+    ("Person_Firname", "PersonFirName_FirName"),
+    ("Person_Secname", "PersonSecName_SecName"),
+)
+PERSON_GRID_BIRTHDAY_FIELDS = ("Person_BirthDay", "Person_Birthday")
 
 #  todo: быстрый фик
 def to_ddmmyyyy(v):
@@ -29,61 +43,214 @@ def to_ddmmyyyy(v):
 
 
 
-def get_raw_data(book_path: Path, start_row: int, max_col: int, min_col: int = 2):
+def iter_raw_data(book_path: Path, start_row: int, max_col: int, min_col: int = 2) -> Iterator[list]:
+    """
+    Построчно читает выгрузку Invitro в режиме read-only (без загрузки всех ячеек в память)
+    и лениво отдает строки с услугами, дополненные датой визита и датой рождения пациента.
+    """
+    book = load_workbook(book_path, read_only=True)
+    try:
+        sheet = book.active
+        # В режиме read-only размер листа берется из <dimension> файла, а многие программы
+        # выгрузки записывают туда неверное значение (например, "A1"): читаем до первой пустой строки
+        sheet.reset_dimensions()
+        visit_date, patient_birthday = None, None
+        seen_rows = set()
+
+        for row in sheet.iter_rows(min_row=start_row, min_col=min_col, max_col=max_col, values_only=True):
+            row = [item for item in row if item is not None]
+            if not row: break
+            if len(row) == 1:
+                visit_date = row[0].strftime('%d.%m.%Y') if hasattr(row[0], 'strftime') else str(row[0])
+            elif len(row) == 2:
+                patient_birthday = row[0].strftime('%d.%m.%Y') if hasattr(row[0], 'strftime') else str(row[0])
+            elif len(row) > 2:
+                if visit_date and patient_birthday:
+                    combined_row = [to_ddmmyyyy(visit_date), to_ddmmyyyy(patient_birthday)] + [to_ddmmyyyy(x) for x in row]
+                    row_tuple = tuple(combined_row)
+                    if row_tuple not in seen_rows:
+                        seen_rows.add(row_tuple)
+                        yield combined_row
+    finally:
+        book.close()
+
+
+def get_raw_data(book_path: Path, start_row: int, max_col: int, min_col: int = 2) -> Iterator[list]:
+    """
+    Строки выгрузки Invitro (см. `iter_raw_data`). Строки читаются лениво, по мере обхода:
+    pipeline передает их сразу в `sanitize_raw_data`, не собирая в список.
+    """
     logger.info(f"Обработка файла {book_path}")
     if not book_path.exists():
         logger.error(f"Ошибка: Файл не найден по пути {book_path}")
-        return []
-
-    book = load_workbook(book_path)
-    sheet = book.active
-    visit_date, patient_birthday = None, None
-    processed_data, seen_rows = [], set()
-
-    for row in sheet.iter_rows(min_row=start_row, min_col=min_col, max_col=max_col, values_only=True):
-        row = [item for item in row if item is not None]
-        if not row: break
-        if len(row) == 1:
-            visit_date = row[0].strftime('%d.%m.%Y') if hasattr(row[0], 'strftime') else str(row[0])
-        elif len(row) == 2:
-            patient_birthday = row[0].strftime('%d.%m.%Y') if hasattr(row[0], 'strftime') else str(row[0])
-        elif len(row) > 2:
-            if visit_date and patient_birthday:
-                combined_row = [to_ddmmyyyy(visit_date), to_ddmmyyyy(patient_birthday)] + [to_ddmmyyyy(x) for x in row]
-                # combined_row = [visit_date, patient_birthday] + row
-                row_tuple = tuple(combined_row)
-                if row_tuple not in seen_rows:
-                    processed_data.append(combined_row)
-                    seen_rows.add(row_tuple)
-    book.close()
-    return processed_data
+        return iter(())
 
+    return iter_raw_data(book_path, start_row, max_col, min_col)
 
-async def get_ids(
+
+def _valid_person_id(row: Record) -> str | None:
+    person_id = row.person.id
+    return person_id if is_set(person_id) and is_person_id_valid(person_id) else None
+
+
+def _report_event_id(row: Record) -> str | None:
+    """ID события для запроса отчета по анализу или None, если запрос не нужен."""
+    if _valid_person_id(row) is None:
+        return None
+    # Бизнес-логика: выполняем только если есть данные о тесте и история
+    if row.test_evmias is None or not is_set(row.test_evmias) or not row.tests_history:
+        return None
+
+    # Извлекаем ID события. `tests_history` может быть списком или одним элементом.
+    tests_history = row.tests_history
+    if isinstance(tests_history, list) and tests_history:
+        return tests_history[0].get("event_id")
+    elif isinstance(tests_history, dict):
+        return tests_history.get("event_id")
+    return None
+
+
+def _grid_value(grid_row: dict, fields: tuple):
+    for field in fields:
+        if field in grid_row:
+            return grid_row[field]
+    return None
+
+
+def _grid_names(grid_row: dict) -> list:
+    return [str(_grid_value(grid_row, fields) or "").casefold() for fields in PERSON_GRID_NAME_FIELDS]
+
+
+def _fold_yo(value: str) -> str:
+    return value.replace("ё", "е")
+
+
+def _match_person(grid_rows: list, key: tuple) -> str | None:
+    """
+    Ищет пациента среди строк пакетного поиска так, чтобы результат совпал с поиском по ФИО.
+    Точные правила сравнения ФИО шлюзом неизвестны, поэтому кандидаты отбираются дважды:
+    строго (ФИО совпадает полностью) и нестрого (ФИО начинается с искомого, ё и е не различаются);
+    регистр не учитывается в обоих случаях. Ответ шлюза на поиск по ФИО лежит между этими
+    наборами, поэтому Person_id возвращается, только если каждый из них — одна и та же строка.
+    Иначе возвращает None, и пациент ищется отдельным запросом.
+    """
+    *names, birth_day = key
+    names = [name.casefold() for name in names]
+    grid_rows = [
+        (grid_row, _grid_names(grid_row)) for grid_row in grid_rows
+        if _grid_value(grid_row, PERSON_GRID_BIRTHDAY_FIELDS) == birth_day
+    ]
+    loose = [
+        grid_row for grid_row, grid_names in grid_rows
+        if all(_fold_yo(grid_name).startswith(_fold_yo(name)) for grid_name, name in zip(grid_names, names))
+    ]
+    strict = [grid_row for grid_row, grid_names in grid_rows if grid_names == names]
+    if len(loose) != 1 or len(strict) != 1:
+        return None
+    return strict[0].get("Person_id")
+
+
+def _unresolved_person_key(row) -> tuple | None:
+    # При возобновлении задачи строки с уже найденным ID пропускаются
+    person_id = row.person.id
+    if not is_set(person_id) or person_id in (None, constants.PERSON_ID_STATUS_API_ERROR):
+        return row.person.key
+    return None
+
+
+async def resolve_person_batches(
         service: GatewayService, data: list,
         task_id: str, manager,
-        start_progress: int = 35, end_progress: int = 45
+        start_progress: int, end_progress: int
 ) -> list:
-    result = []
-    total = len(data)
-
-    if total == 0:
-        return []
+    """
+    Пакетный поиск ID пациентов (`PERSON_BATCH_MODE=surname`): пациенты с одной фамилией
+    ищутся одним запросом, а ФИО и дата рождения сопоставляются локально (`_match_person`).
+    Найденные ID записываются в строки и в кеш `person_id`; остальных пациентов ищет `get_ids`.
+    """
+    if settings.PERSON_BATCH_MODE != "surname":
+        return data
 
-    progress_span = end_progress - start_progress
+    groups = {}
+    for key in dict.fromkeys(_unresolved_person_key(row) for row in data):
+        if key is not None and key[0]:
+            groups.setdefault(key[0], []).append(key)
+    groups = {last_name: members for last_name, members in groups.items()
+              if len(members) >= settings.PERSON_BATCH_MIN_GROUP}
+    if not groups:
+        return data
 
-    for i, row in enumerate(data):
-        record = await fetch_person_id(service, row)
-        result.append(record)
+    person_ids = {}
+
+    async def fetch(last_name):
+        grid_rows = await search_persons(service, last_name=last_name)
+        if grid_rows is None:
+            return
+        for key in groups[last_name]:
+            person_id = _match_person(grid_rows, key)
+            if person_id is not None:
+                person_ids[key] = person_id
+                await fetch_person_id.prime(service, *key, value=person_id)
+
+    try:
+        await run_deduplicated(
+            list(groups), fetch,
+            task_id=task_id, manager=manager,
+            start_progress=start_progress, end_progress=end_progress,
+            detail="Пакетный поиск: {done} из {total}", stage="Пакетный поиск ID пациентов"
+        )
+    finally:
+        for row in data:
+            if row.person.key in person_ids:
+                row.person.id = person_ids[row.person.key]
+        logger.log(
+            "INFO" if manager is not None else "DEBUG",
+            f"[{task_id}] Пакетный поиск: найдено {len(person_ids)} из "
+            f"{sum(len(members) for members in groups.values())} пациентов в {len(groups)} группах"
+        )
+    return data
 
-        current_progress = start_progress + int(((i + 1) / total) * progress_span)
-        progress_message = {
-            "progress": current_progress,
-            "detail": f"Обработано {i + 1} из {total}"
-        }
-        await manager.send_progress(task_id, progress_message)
 
-    return result
+async def get_ids(
+        service: GatewayService, data: list,
+        task_id: str, manager,
+        start_progress: int = 35, end_progress: int = 45,
+        batch: bool = True
+) -> list:
+    """
+    Ищет ID пациентов: сначала пакетно (`resolve_person_batches`, если `batch`),
+    затем оставшихся — по одному.
+    """
+    if batch:
+        middle_progress = start_progress + (end_progress - start_progress) // 2
+        await resolve_person_batches(
+            service, data, task_id=task_id, manager=manager,
+            start_progress=start_progress, end_progress=middle_progress
+        )
+        start_progress = middle_progress
+    keys = [_unresolved_person_key(row) for row in data]
+
+    async def fetch(key):
+        last_name, first_name, middle_name, birth_day = key
+        return await fetch_person_id(
+            service,
+            last_name=last_name, first_name=first_name, middle_name=middle_name, birth_day=birth_day
+        )
+
+    person_ids = {}
+    try:
+        await run_deduplicated(
+            keys, fetch,
+            task_id=task_id, manager=manager,
+            start_progress=start_progress, end_progress=end_progress,
+            detail="Обработано {done} из {total}", stage="Поиск ID пациентов",
+            results=person_ids
+        )
+    finally:
+        for row, key in zip(data, keys):
+            if key in person_ids:
+                row.person.id = person_ids[key]
+    return data
 
 
 async def get_test_data_from_evmias(
@@ -94,33 +261,33 @@ async def get_test_data_from_evmias(
     """
     Обогащает записи данными об услугах из ЕВМИАС.
     """
-    total = len(data)
-    if total == 0:
-        return data
-
-    progress_span = end_progress - start_progress
-
-    for i, row in enumerate(data):
-        person_id = row.get("person", {}).get("id")
-        if is_person_id_valid(person_id):
-            test_code = row['test_src']['code']
-            test_data_list = await fetch_test_data_from_evmias(service, test_code)
-            found_test = None
-            if test_data_list:
-                # Ищем точное совпадение по коду в ответе
-                for test_item in test_data_list:
-                    if test_item.get("UslugaComplex_Code") == test_code:
-                        found_test = sanitize_test_data_from_evmias(test_item)
-                        break
-            row['test_evmias'] = found_test
-        # Отправляем прогресс
-        current_progress = start_progress + int(((i + 1) / total) * progress_span)
-        progress_message = {
-            "progress": current_progress,
-            "detail": f"Поиск информации об услугах: {i + 1} из {total}"
-        }
-        await manager.send_progress(task_id, progress_message)
-
+    keys = [
+        row.test_src.code if _valid_person_id(row) and not is_set(row.test_evmias) else None
+        for row in data
+    ]
+
+    async def fetch(test_code):
+        test_data_list = await fetch_test_data_from_evmias(service, test_code)
+        if test_data_list:
+            # Ищем точное совпадение по коду в ответе
+            for test_item in test_data_list:
+                if test_item.get("UslugaComplex_Code") == test_code:
+                    return sanitize_test_data_from_evmias(test_item)
+        return None
+
+    tests = {}
+    try:
+        await run_deduplicated(
+            keys, fetch,
+            task_id=task_id, manager=manager,
+            start_progress=start_progress, end_progress=end_progress,
+            detail="Поиск информации об услугах: {done} из {total}", stage="Справочник услуг",
+            results=tests
+        )
+    finally:
+        for row, test_code in zip(data, keys):
+            if test_code in tests:
+                row.test_evmias = tests[test_code]
     return data
 
 
@@ -131,32 +298,32 @@ async def get_person_tests_history(
 ) -> list:
     """
     Обогащает записи историей лабораторных исследований ('lab') пациента.
+    История запрашивается один раз на пациента и общая для всех его строк.
     """
-    total = len(data)
-    if total == 0:
-        return data
-
-    progress_span = end_progress - start_progress
-
-    for i, row in enumerate(data):
-        person_id = row.get("person", {}).get("id")
-        if is_person_id_valid(person_id):
-            test_history_raw = await fetch_person_tests_history(service, person_id)
-            if not isinstance(test_history_raw, list):
-                test_history_raw = []
-            filtered_history = [
-                item for item in test_history_raw
-                if 'lab' in item.get("UslugaComplex_AttributeList", "")
-            ]
-            row['tests_history'] = filtered_history
-
-        current_progress = start_progress + int(((i + 1) / total) * progress_span)
-        progress_message = {
-            "progress": current_progress,
-            "detail": f"Получение истории анализов: {i + 1} из {total}"
-        }
-        await manager.send_progress(task_id, progress_message)
-
+    keys = [_valid_person_id(row) if not is_set(row.tests_history) else None for row in data]
+
+    async def fetch(person_id):
+        test_history_raw = await fetch_person_tests_history(service, person_id)
+        if not isinstance(test_history_raw, list):
+            test_history_raw = []
+        return [
+            item for item in test_history_raw
+            if 'lab' in item.get("UslugaComplex_AttributeList", "")
+        ]
+
+    histories = {}
+    try:
+        await run_deduplicated(
+            keys, fetch,
+            task_id=task_id, manager=manager,
+            start_progress=start_progress, end_progress=end_progress,
+            detail="Получение истории анализов: {done} из {total}", stage="История анализов",
+            results=histories
+        )
+    finally:
+        for row, person_id in zip(data, keys):
+            if person_id in histories:
+                row.tests_history = histories[person_id]
     return data
 
 
@@ -168,52 +335,40 @@ async def get_pay_type(
     """
     Обогащает записи данными о типе оплаты, полученными из отчета по анализу.
     """
-    total = len(data)
-    if total == 0:
-        return data
-
-    progress_span = end_progress - start_progress
-
-    for i, row in enumerate(data):
-        person_id = row.get("person", {}).get("id")
-        if is_person_id_valid(person_id):
-        # Бизнес-логика: выполняем только если есть данные о тесте и история
-            if row.get("test_evmias") is not None and row.get("tests_history"):
-                tests_history = row["tests_history"]
-
-                # Извлекаем ID события. `tests_history` может быть списком или одним элементом.
-                # На будущих этапах он будет отфильтрован до одного, но сейчас лучше сделать проверку.
-                test_id = None
-                if isinstance(tests_history, list) and tests_history:
-                    test_id = tests_history[0].get("event_id")
-                elif isinstance(tests_history, dict):
-                    test_id = tests_history.get("event_id")
-
-                if test_id:
-                    test_report_raw = await fetch_test_report(service, test_id)
-                    # Безопасно извлекаем вложенные данные
-                    if test_report_raw:
-                        report_data = test_report_raw.get("map", {}).get("EvnUslugaPar", {}).get("item", [{}])[0].get(
-                            "data")
-                        if report_data:
-                            row["test_report"] = sanitize_test_info(report_data)
-                        else:
-                            row["test_report"] = None
-                    else:
-                        row["test_report"] = None
-                else:
-                    row["test_report"] = None
-        else:
-            row["test_report"] = None
-
-        # Отправляем прогресс
-        current_progress = start_progress + int(((i + 1) / total) * progress_span)
-        progress_message = {
-            "progress": current_progress,
-            "detail": f"Поиск в истории анализов: {i + 1} из {total}"
-        }
-        await manager.send_progress(task_id, progress_message)
-
+    # При возобновлении задачи строки с уже заполненным `test_report` пропускаются
+    pending = [not is_set(row.test_report) for row in data]
+    keys = [_report_event_id(row) if is_pending else None for row, is_pending in zip(data, pending)]
+
+    async def fetch(test_id):
+        test_report_raw = await fetch_test_report(service, test_id)
+        # Безопасно извлекаем вложенные данные
+        if test_report_raw:
+            report_data = test_report_raw.get("map", {}).get("EvnUslugaPar", {}).get("item", [{}])[0].get("data")
+            if report_data:
+                return sanitize_test_info(report_data)
+        return None
+
+    reports = {}
+    try:
+        await run_deduplicated(
+            keys, fetch,
+            task_id=task_id, manager=manager,
+            start_progress=start_progress, end_progress=end_progress,
+            detail="Поиск в истории анализов: {done} из {total}", stage="Отчеты по анализам",
+            results=reports
+        )
+    finally:
+        for row, test_id, is_pending in zip(data, keys, pending):
+            if not is_pending:
+                continue
+            if test_id is not None:
+                if test_id in reports:
+                    row.test_report = reports[test_id]
+            elif _valid_person_id(row) is None:
+                row.test_report = None
+            elif row.test_evmias is not None and is_set(row.test_evmias) and row.tests_history:
+                # Есть тест и история, но в истории нет ID события
+                row.test_report = None
     return data
 
 
@@ -226,48 +381,73 @@ async def get_medical_history(
     Запасной механизм: для записей, где не удалось найти тип оплаты,
     пытается найти его через общую медицинскую историю.
     """
-    total = len(data)
-    if total == 0:
-        return data
-
-    progress_span = end_progress - start_progress
-
-    for i, row in enumerate(data):
-        person_id = row.get("person", {}).get("id")
-        if is_person_id_valid(person_id):
-            # Логика: выполняем только если `test_report` еще не заполнен
-            if not row.get("test_report"):
-                person_id = row["person"]["id"]
-                visit_date = row["visit_date"]
-
-                medical_history_raw = await fetch_medical_history(service, person_id)
-
-                # Санитизация и фильтрация истории по дате визита (+- 14 дней)
-                sanitized_history = sanitize_medical_history(medical_history_raw, visit_date)
-                row["medical_history"] = sanitized_history
-
-                # Если в отфильтрованной истории что-то нашлось
-                if sanitized_history:
-                    # Берем первое подходящее событие
-                    first_event = sanitized_history[0]
-                    event_id = first_event.get("children_evn_id")
-                    med_staff_fact_id = first_event.get("med_staff_fact_id")
-
-                    if event_id:
-                        pay_type_id = await fetch_pay_type_id(service, event_id)
-                        if pay_type_id:
-                            row["test_report"] = {
-                                "pay_type_id": pay_type_id,
-                                "pay_type": PAY_TYPE_IDS.get(pay_type_id, "Неизвестно"),
-                                "med_staff_fact_id": med_staff_fact_id
-                            }
-
-        # Отправляем прогресс в любом случае
-        current_progress = start_progress + int(((i + 1) / total) * progress_span)
-        progress_message = {
-            "progress": current_progress,
-            "detail": f"Поиск в мед. истории: {i + 1} из {total}"
-        }
-        await manager.send_progress(task_id, progress_message)
-
+    # Логика: выполняем только если `test_report` еще не заполнен;
+    # при возобновлении задачи строки с уже заполненной `medical_history` пропускаются
+    keys = [
+        _valid_person_id(row) if not row.test_report and not is_set(row.medical_history) else None
+        for row in data
+    ]
+    middle_progress = start_progress + (end_progress - start_progress) // 2
+
+    # История пациента разбирается один раз (индекс по дате) для всех его строк;
+    # найденное событие общее для всех строк пациента с одной датой визита
+    histories = {}
+    indexes = {}
+    events = {}
+
+    def history_events(row, person_id) -> list:
+        event_key = (person_id, row.visit_date)
+        if event_key not in events:
+            if person_id not in indexes:
+                indexes[person_id] = MedicalHistoryIndex(histories[person_id])
+            event = indexes[person_id].first_event(row.visit_date)
+            events[event_key] = [event] if event else []
+        return events[event_key]
+
+    def event_id_of(row_events: list) -> str | None:
+        return row_events[0].get("children_evn_id") if row_events else None
+
+    async def fetch_history(person_id):
+        return await fetch_medical_history(service, person_id)
+
+    async def fetch_pay_type(event_id):
+        return await fetch_pay_type_id(service, event_id)
+
+    event_ids, pay_type_ids = [], {}
+    try:
+        try:
+            await run_deduplicated(
+                keys, fetch_history,
+                task_id=task_id, manager=manager,
+                start_progress=start_progress, end_progress=middle_progress,
+                detail="Поиск в мед. истории: {done} из {total}", stage="Мед. история",
+                results=histories
+            )
+        finally:
+            # Найденные посещения сохраняются и при ошибке: при возобновлении задачи
+            # мед. история повторно не запрашивается, определяется только тип оплаты
+            for row, person_id in zip(data, keys):
+                if person_id in histories:
+                    row.medical_history = history_events(row, person_id)
+
+        event_ids = [
+            event_id_of(row.medical_history) if not row.test_report and row.medical_history else None
+            for row in data
+        ]
+        await run_deduplicated(
+            event_ids, fetch_pay_type,
+            task_id=task_id, manager=manager,
+            start_progress=middle_progress, end_progress=end_progress,
+            detail="Определение типа оплаты посещения: {done} из {total}", stage="Тип оплаты посещения",
+            results=pay_type_ids
+        )
+    finally:
+        for row, event_id in zip(data, event_ids):
+            pay_type_id = pay_type_ids.get(event_id)
+            if pay_type_id:
+                row.test_report = {
+                    "pay_type_id": pay_type_id,
+                    "pay_type": PAY_TYPE_IDS.get(pay_type_id, "Неизвестно"),
+                    "med_staff_fact_id": row.medical_history[0].get("med_staff_fact_id")
+                }
     return data
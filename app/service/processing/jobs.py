@@ -0,0 +1,278 @@
+"""
+Очередь задач обработки файлов.
+
+Задачи хранятся в SQLite (`JOB_DB_PATH`) в состояниях queued -> running -> done | failed
+и выполняются пулом из `JOB_WORKERS` воркеров, запускаемых при старте приложения.
+Воркер атомарно забирает задачу из очереди, поэтому несколько процессов могут работать
+с одной базой. Задача, прерванная перезапуском, остается в состоянии running без heartbeat;
+по истечении `JOB_STALE_TIMEOUT` она возвращается в очередь и продолжается с последней
+контрольной точки.
+"""
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, NamedTuple
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+from app.core.logger_setup import logger
+from app.core.websocket_manager import manager
+from app.service.gateway import GatewayService
+from .pipeline import BASE_DIR, run_processing_pipeline
+
+settings = get_settings()
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_COLUMNS = (
+    "id", "owner", "filename", "input_path", "output_path", "state", "resume",
+    "worker", "error", "created_at", "started_at", "finished_at", "heartbeat_at"
+)
+
+
+class Job(NamedTuple):
+    id: str
+    owner: str
+    filename: str
+    input_path: str
+    output_path: str
+    state: str
+    resume: bool
+    worker: str | None
+    error: str | None
+    created_at: float
+    started_at: float | None
+    finished_at: float | None
+    heartbeat_at: float | None
+
+    def as_dict(self) -> dict:
+        return {
+            "task_id": self.id,
+            "owner": self.owner,
+            "filename": self.filename,
+            "state": self.state,
+            "resume": self.resume,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore:
+    """Таблица задач в SQLite. Методы синхронные, вызываются через `run_in_threadpool`."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " input_path TEXT NOT NULL,"
+                " output_path TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " resume INTEGER NOT NULL DEFAULT 0,"
+                " worker TEXT,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " heartbeat_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+            logger.info(f"Job store opened: {self.path}")
+        return self._conn
+
+    @staticmethod
+    def _to_job(row) -> Job:
+        values = dict(zip(_COLUMNS, row))
+        values["resume"] = bool(values["resume"])
+        return Job(**values)
+
+    def enqueue(self, job_id: str, owner: str, filename: str, input_path: Path, output_path: Path,
+                resume: bool = False) -> bool:
+        """
+        Ставит задачу в очередь. Завершенная задача с тем же id ставится повторно
+        (возобновление). Возвращает False, если задача уже в очереди или выполняется.
+        """
+        with self._lock:
+            cursor = self._connection().execute(
+                f"INSERT INTO jobs ({', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL, ?, NULL, NULL, NULL)"
+                " ON CONFLICT (id) DO UPDATE SET"
+                "  state = excluded.state, resume = excluded.resume, worker = NULL, error = NULL,"
+                "  created_at = excluded.created_at, started_at = NULL, finished_at = NULL, heartbeat_at = NULL"
+                " WHERE jobs.state NOT IN (?, ?)",
+                (job_id, owner, filename, str(input_path), str(output_path), QUEUED, int(resume), time.time(),
+                 QUEUED, RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def claim(self, worker: str, scheduling: str) -> Job | None:
+        """Атомарно переводит следующую задачу из очереди в running и возвращает ее."""
+        if scheduling == "fair":
+            # Сначала задачи тех, у кого меньше задач в работе, затем по времени постановки
+            order = "(SELECT COUNT(*) FROM jobs r WHERE r.owner = j.owner AND r.state = 'running'), j.created_at"
+        else:
+            order = "j.created_at"
+
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT j.id FROM jobs j WHERE j.state = ? ORDER BY {order} LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET state = ?, worker = ?, started_at = ?, heartbeat_at = ?"
+                    " WHERE id = ? AND state = ?",
+                    (RUNNING, worker, now, now, row[0], QUEUED)
+                )
+                job = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (row[0],)).fetchone()
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return self._to_job(job)
+
+    def heartbeat(self, job_id: str):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND state = ?", (time.time(), job_id, RUNNING)
+            )
+
+    def finish(self, job_id: str, error: str | None):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED if error else DONE, error, time.time(), job_id)
+            )
+
+    def requeue_stale(self, timeout: float) -> int:
+        """Возвращает в очередь задачи, воркер которых перестал отправлять heartbeat."""
+        with self._lock:
+            cursor = self._connection().execute(
+                "UPDATE jobs SET state = ?, resume = 1, worker = NULL WHERE state = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, time.time() - timeout)
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_job(row) if row else None
+
+    def list(self, state: str | None = None, limit: int = 100) -> List[Job]:
+        query = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+        params: tuple = ()
+        if state:
+            query += " WHERE state = ?"
+            params = (state,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._connection().execute(query, params + (limit,)).fetchall()
+        return [self._to_job(row) for row in rows]
+
+
+class JobQueue:
+    """Пул воркеров, выполняющих задачи из `JobStore`."""
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self._client: httpx.AsyncClient | None = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def start(self, client: httpx.AsyncClient):
+        self._client = client
+        self._wakeup = asyncio.Event()
+        requeued = await run_in_threadpool(self.store.requeue_stale, settings.JOB_STALE_TIMEOUT)
+        if requeued:
+            logger.info(f"В очередь возвращено прерванных задач: {requeued}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, settings.JOB_WORKERS))]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        logger.info(f"Очередь задач запущена: воркеров {settings.JOB_WORKERS}, планирование {settings.JOB_SCHEDULING}")
+
+    async def stop(self):
+        """Останавливает воркеры. Выполняемые задачи будут продолжены после перезапуска."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job_id: str, owner: str, filename: str, input_path: Path, output_path: Path,
+                     resume: bool = False) -> bool:
+        queued = await run_in_threadpool(
+            self.store.enqueue, job_id, owner, filename, input_path, output_path, resume
+        )
+        if queued:
+            self._wakeup.set()
+            await manager.send_progress(job_id, {"progress": 0, "message": "Задача поставлена в очередь..."})
+        return queued
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            job = await run_in_threadpool(self.store.claim, self._worker_id, settings.JOB_SCHEDULING)
+            if job is None:
+                # Задачи, поставленные другим процессом, подхватываются по таймауту
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        logger.info(f"[{job.id}] Задача взята в работу (владелец {job.owner}, продолжение: {job.resume})")
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            error = await run_processing_pipeline(
+                job.id, Path(job.input_path), Path(job.output_path),
+                GatewayService(client=self._client), manager,
+                resume=job.resume
+            )
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            heartbeat.cancel()
+        await run_in_threadpool(self.store.finish, job.id, error)
+        logger.info(f"[{job.id}] Задача завершена: {FAILED if error else DONE}")
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(settings.JOB_HEARTBEAT_INTERVAL)
+            await run_in_threadpool(self.store.heartbeat, job_id)
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(settings.JOB_STALE_TIMEOUT)
+            if await run_in_threadpool(self.store.requeue_stale, settings.JOB_STALE_TIMEOUT):
+                self._wakeup.set()
+
+
+job_queue = JobQueue(JobStore(BASE_DIR / settings.JOB_DB_PATH))
@@ -0,0 +1,88 @@
+"""
+Персистентный (SQLite) уровень кеша справочных запросов.
+
+Используется для данных, которые редко меняются и повторяются от файла к файлу:
+справочник услуг (UslugaComplex) и ID пациентов. Переживает перезапуск контейнера.
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Hashable, Tuple
+
+from app.core.logger_setup import logger
+
+
+class PersistentCacheStore:
+    """
+    Хранилище `namespace -> key -> value` в SQLite с TTL и ограничением размера.
+    Просроченные записи и записи сверх лимита удаляются при записи.
+    """
+
+    def __init__(self, path: Path, maxsize: int):
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lookup_cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS lookup_cache_updated ON lookup_cache (namespace, updated_at)"
+            )
+            logger.info(f"Persistent lookup cache opened: {self.path}")
+        return self._conn
+
+    @staticmethod
+    def _encode_key(key: Hashable) -> str:
+        return json.dumps(key, ensure_ascii=False, default=str)
+
+    def get(self, namespace: str, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM lookup_cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, self._encode_key(key), time.time())
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def set(self, namespace: str, key: Hashable, value: Any, ttl: float):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO lookup_cache (namespace, key, value, expires_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (namespace, self._encode_key(key), json.dumps(value, ensure_ascii=False), now + ttl, now)
+            )
+            conn.execute("DELETE FROM lookup_cache WHERE namespace = ? AND expires_at <= ?", (namespace, now))
+            conn.execute(
+                "DELETE FROM lookup_cache WHERE namespace = ? AND key IN ("
+                " SELECT key FROM lookup_cache WHERE namespace = ?"
+                " ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, self.maxsize)
+            )
+
+    def clear(self, namespace: str):
+        with self._lock:
+            self._connection().execute("DELETE FROM lookup_cache WHERE namespace = ?", (namespace,))
+
+    def size(self, namespace: str) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM lookup_cache WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
@@ -0,0 +1,223 @@
+"""
+Pipeline обработки файла с контрольными точками.
+
+После каждого этапа результат сохраняется в `materials/results/<task_id>/NN.<имя>.json`
+(формат и сжатие задаются `CHECKPOINT_MODE`, см. `checkpoint.py`).
+Если этап, работающий со шлюзом, завершился ошибкой, его частичный результат
+сохраняется в `NN.<имя>.partial.json`. При возобновлении задачи pipeline продолжает
+работу со следующего после последней контрольной точки этапа, а прерванный этап
+обрабатывает только еще не обработанные строки.
+"""
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, List, NamedTuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+from app.core.exceptions import GatewayConnectivityError
+from app.core.logger_setup import logger
+from app.service import metrics
+from app.service.gateway import GatewayService
+from .getter import (
+    get_raw_data,
+    get_ids,
+    get_test_data_from_evmias,
+    get_person_tests_history,
+    get_pay_type, get_medical_history
+)
+from .sanitizer import (
+    sanitize_raw_data,
+    sanitize_persons_tests_history,
+    sanitize_for_report
+)
+from .checkpoint import CheckpointWriter, find_checkpoint
+from .record import records_from_dicts
+from .streaming import run_streaming_enrichment
+from .tool import save_json, load_json, make_report
+
+settings = get_settings()
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
+UPLOADS_DIR = BASE_DIR / "materials" / "uploads"
+RESULTS_DIR = BASE_DIR / "materials" / "results"
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+
+PARTIAL_SUFFIX = ".partial.json"
+METRICS_FILE = "metrics.json"
+
+
+class Stage(NamedTuple):
+    checkpoint: str
+    message: str
+    progress: int
+    run: Callable[[list | None], Awaitable[list]]
+    # Этап работает со шлюзом и умеет продолжать обработку с места остановки
+    resumable: bool = False
+    # Результат этапа — записи `Record` (в контрольной точке — их JSON)
+    records: bool = True
+
+    @property
+    def name(self) -> str:
+        return self.checkpoint.removesuffix(".json")
+
+    @property
+    def partial_checkpoint(self) -> str:
+        return self.checkpoint.removesuffix(".json") + PARTIAL_SUFFIX
+
+
+def _build_stages(task_id: str, input_path: Path, service: GatewayService, manager) -> List[Stage]:
+    def gateway_stage(getter, start_progress: int, end_progress: int):
+        async def run(data: list) -> list:
+            return await getter(
+                service, data,
+                task_id=task_id, manager=manager,
+                start_progress=start_progress, end_progress=end_progress
+            )
+        return run
+
+    def read_and_sanitize() -> list:
+        # Строки выгрузки преобразуются в записи по мере чтения: сырые строки
+        # всего файла в памяти не собираются (и отдельной контрольной точки у них нет)
+        return sanitize_raw_data(get_raw_data(input_path, settings.START_ROW, settings.MAX_COL))
+
+    async def read(_) -> list:
+        return await run_in_threadpool(read_and_sanitize)
+
+    async def sanitize_history(data: list) -> list:
+        return await run_in_threadpool(sanitize_persons_tests_history, data)
+
+    async def prepare_report(data: list) -> list:
+        return await run_in_threadpool(sanitize_for_report, data)
+
+    stages = [
+        Stage("02.sanitized_raw_data.json", "Чтение данных из файла...", 2, read),
+    ]
+    if settings.PIPELINE_MODE == "streaming":
+        # В потоковом режиме группы пациентов находятся на разных этапах, поэтому
+        # прерванная обработка возобновляется целиком (повторные запросы попадают в кеш)
+        stages.append(Stage(
+            "09.pay_type_by_medical_history.json", "Потоковая обработка записей в ЕВМИАС...", 10,
+            gateway_stage(run_streaming_enrichment, 10, 90)
+        ))
+    else:
+        stages += [
+            Stage("03.persons_ids.json", "Поиск ID пациентов в ЕВМИАС...", 10,
+                  gateway_stage(get_ids, 10, 20), resumable=True),
+            Stage("05.test_data_from_evmias.json", "Получение данных об услугах из ЕВМИАС ...", 20,
+                  gateway_stage(get_test_data_from_evmias, 20, 30), resumable=True),
+            Stage("06.persons_tests_history.json", "Запрос истории анализов пациентов...", 30,
+                  gateway_stage(get_person_tests_history, 30, 40), resumable=True),
+            Stage("07.sanitized_persons_tests_history.json", "Очистка данных истории анализов...", 40,
+                  sanitize_history),
+            Stage("08.pay_type_by_tests_history.json", "Определение типа оплаты #1...", 50,
+                  gateway_stage(get_pay_type, 50, 70), resumable=True),
+            Stage("09.pay_type_by_medical_history.json", "Определение типа оплаты #2...", 70,
+                  gateway_stage(get_medical_history, 70, 90), resumable=True),
+        ]
+    stages.append(Stage("10.data_for_report.json", "Подготовка отчета...", 90, prepare_report, records=False))
+    return stages
+
+
+def find_resume_point(task_results_path: Path, stages: List[Stage]) -> tuple[int, Path | None]:
+    """
+    Возвращает индекс этапа, с которого нужно продолжить, и файл с данными для него:
+    частичный результат этого этапа или последнюю завершенную контрольную точку.
+    Данные в файле — записи, если это частичный результат или `stages[index - 1].records`.
+    """
+    for index in range(len(stages), 0, -1):
+        checkpoint = find_checkpoint(task_results_path / stages[index - 1].checkpoint)
+        if checkpoint is not None:
+            break
+    else:
+        index, checkpoint = 0, None
+
+    if index < len(stages) and stages[index].resumable:
+        partial = find_checkpoint(task_results_path / stages[index].partial_checkpoint)
+        if partial is not None:
+            return index, partial
+    return index, checkpoint
+
+
+async def run_processing_pipeline(
+        task_id: str, input_path: Path, output_path: Path, service: GatewayService, manager,
+        resume: bool = False
+) -> str | None:
+    """
+    pipeline обработки файла.
+    При `resume=True` продолжает задачу с последней сохраненной контрольной точки.
+    Возвращает текст ошибки или None при успешном завершении.
+    Метрики задачи сохраняются в `materials/results/<task_id>/metrics.json`.
+    """
+    task_results_path = RESULTS_DIR / task_id
+    task_results_path.mkdir(exist_ok=True)
+
+    with metrics.task_metrics(task_id) as task_metrics:
+        error = await _run_stages(task_id, input_path, output_path, service, manager, resume, task_results_path)
+
+    metrics.record_task_result(error is None)
+    summary = {**task_metrics.as_dict(), "resumed": resume, "error": error}
+    await run_in_threadpool(save_json, summary, task_results_path / METRICS_FILE)
+    return error
+
+
+async def _run_stages(
+        task_id: str, input_path: Path, output_path: Path, service: GatewayService, manager,
+        resume: bool, task_results_path: Path
+) -> str | None:
+    stages = _build_stages(task_id, input_path, service, manager)
+    checkpoints = CheckpointWriter(task_id, task_results_path)
+
+    try:
+        start_index, data = 0, None
+        if resume:
+            start_index, resume_path = find_resume_point(task_results_path, stages)
+            if resume_path is not None:
+                logger.info(f"[{task_id}] Возобновление с этапа {start_index + 1}, данные из {resume_path.name}")
+                data = await run_in_threadpool(load_json, resume_path)
+                # Частичный результат есть только у этапов, работающих с записями
+                is_partial = start_index < len(stages) and \
+                    resume_path.name.startswith(stages[start_index].partial_checkpoint)
+                if is_partial or stages[start_index - 1].records:
+                    data = await run_in_threadpool(records_from_dicts, data)
+
+        for stage in stages[start_index:]:
+            await manager.send_progress(task_id, {"progress": stage.progress, "message": stage.message})
+            started = time.perf_counter()
+            try:
+                data = await stage.run(data)
+            except BaseException:
+                # Строки изменяются этапом на месте: сохраняем уже полученные результаты
+                if stage.resumable and data is not None:
+                    await checkpoints.save(data, stage.partial_checkpoint, wait=True)
+                raise
+            finally:
+                metrics.record_stage(stage.name, time.perf_counter() - started)
+            await checkpoints.save(
+                data, stage.checkpoint, replaces=stage.partial_checkpoint if stage.resumable else None
+            )
+
+        started = time.perf_counter()
+        await run_in_threadpool(make_report, data, output_path)
+        metrics.record_stage("11.report", time.perf_counter() - started)
+        await checkpoints.flush()
+
+        download_url = f"/api/processing/download/{task_id}"
+        await manager.send_progress(task_id, {
+            "progress": 100, "message": "Отчет готов к скачиванию!", "download_url": download_url
+        })
+        return None
+
+    except GatewayConnectivityError as e:
+        await checkpoints.flush(raise_errors=False)
+        await manager.send_progress(task_id, {"progress": -1, "message": str(e)})
+        return str(e) or type(e).__name__
+
+    except Exception as e:
+        await checkpoints.flush(raise_errors=False)
+        import traceback
+        error_details = traceback.format_exc()
+        logger.error(f"ОШИБКА в задаче {task_id}: {e}, trace: {error_details}")
+        await manager.send_progress(task_id, {"progress": -1, "message": f"Произошла критическая ошибка: {e}"})
+        return str(e) or type(e).__name__
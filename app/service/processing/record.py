@@ -0,0 +1,127 @@
+"""
+Модель записей pipeline.
+
+Запись (`Record`) — одна строка выгрузки Invitro, которую этапы обогащают данными из ЕВМИАС.
+Данные пациента (`Person`) хранятся один раз и разделяются всеми его записями;
+история анализов пациента, полученная из шлюза, тоже одна на всех его записях.
+
+Поля этапов, которые еще не выполнялись для записи, имеют значение `NOT_SET`
+(в JSON контрольных точек такие ключи отсутствуют), а `None` означает, что этап
+выполнен, но ничего не нашел. Формат JSON совпадает с прежними вложенными словарями,
+поэтому старые контрольные точки читаются без изменений.
+"""
+from dataclasses import dataclass
+from typing import Any
+
+
+class _NotSet:
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "NOT_SET"
+
+
+NOT_SET: Any = _NotSet()
+
+# Поля этапов обогащения в порядке их заполнения
+STAGE_FIELDS = ("test_evmias", "tests_history", "test_report", "medical_history")
+
+
+def is_set(value) -> bool:
+    return value is not NOT_SET
+
+
+@dataclass(slots=True, eq=False)
+class Person:
+    last_name: str
+    first_name: str
+    middle_name: str
+    birth_day: str
+    id: Any = NOT_SET
+
+    @property
+    def key(self) -> tuple:
+        return self.last_name, self.first_name, self.middle_name, self.birth_day
+
+    def as_dict(self) -> dict:
+        data = {
+            "last_name": self.last_name,
+            "first_name": self.first_name,
+            "middle_name": self.middle_name,
+            "birth_day": self.birth_day,
+        }
+        if is_set(self.id):
+            data["id"] = self.id
+        return data
+
+
+@dataclass(slots=True, eq=False)
+class TestSource:
+    code: str
+    name: str
+    quantity: int
+    price: float
+
+    def as_dict(self) -> dict:
+        return {"code": self.code, "name": self.name, "quantity": self.quantity, "price": self.price}
+
+
+@dataclass(slots=True, eq=False)
+class Record:
+    inz: str
+    visit_date: str
+    person: Person
+    test_src: TestSource
+    test_evmias: Any = NOT_SET
+    tests_history: Any = NOT_SET
+    test_report: Any = NOT_SET
+    medical_history: Any = NOT_SET
+
+    def as_dict(self) -> dict:
+        data = {
+            "inz": self.inz,
+            "visit_date": self.visit_date,
+            "person": self.person.as_dict(),
+            "test_src": self.test_src.as_dict(),
+        }
+        for field in STAGE_FIELDS:
+            value = getattr(self, field)
+            if is_set(value):
+                data[field] = value
+        return data
+
+
+def records_from_dicts(data: list) -> list[Record]:
+    """
+    Восстанавливает записи из JSON контрольной точки.
+    Записи одного пациента снова разделяют объект `Person` и одинаковую историю анализов.
+    """
+    persons = {}
+    histories = {}
+    records = []
+    for row in data:
+        person_data = row["person"]
+        person_key = (
+            person_data["last_name"], person_data["first_name"], person_data["middle_name"],
+            person_data["birth_day"], person_data.get("id", NOT_SET)
+        )
+        person = persons.get(person_key)
+        if person is None:
+            person = persons[person_key] = Person(*person_key)
+
+        test_src = row["test_src"]
+        record = Record(
+            inz=row["inz"], visit_date=row["visit_date"], person=person,
+            test_src=TestSource(test_src["code"], test_src["name"], test_src["quantity"], test_src["price"]),
+            **{field: row[field] for field in STAGE_FIELDS if field in row}
+        )
+        history = record.tests_history
+        if isinstance(history, list) and history:
+            shared = histories.setdefault(person_key, history)
+            if shared is not history and shared == history:
+                record.tests_history = shared
+        records.append(record)
+    return records
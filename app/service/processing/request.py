@@ -1,17 +1,49 @@
-from async_lru import alru_cache
+import json
 from datetime import datetime
 
 from app.service.gateway import GatewayService
 from app.core.config import get_settings
 from app.core.logger_setup import logger
+from app.service.metrics import instrumented
 from . import constants
+from .cache import cached
+from .tool import is_person_id_valid
 from ...core.exceptions import GatewayConnectivityError
 
 settings = get_settings()
 
+# Проекции ответов шлюза: только поля, которые используются при обработке
+# (ответы могут содержать сотни записей с десятками полей)
+PERSON_SEARCH_PROJECTION = {"totalCount": None, "data": {
+    "Person_id": None,
+    "Person_Surname": None, "Person_Firname": None, "Person_Secname": None,
+    "PersonSurName_SurName": None, "PersonFirName_FirName": None, "PersonSecName_SecName": None,
+    "Person_BirthDay": None, "Person_Birthday": None,
+}}
+TEST_DATA_PROJECTION = {"data": {"UslugaComplex_id": None, "UslugaComplex_Code": None, "UslugaComplex_Name": None}}
+TESTS_HISTORY_PROJECTION = {"data": {
+    "Evn_id": None, "ED_MedPersonal_id": None, "EvnUslugaPar_setDate": None, "UslugaComplex_Name": None,
+    "MedService_Name": None, "UslugaComplex_id": None, "UslugaComplex_AttributeList": None, "sort": None,
+}}
+TEST_REPORT_PROJECTION = {"map": {"EvnUslugaPar": {"item": {"data": {"EvnDirection_id": None, "PayType_id": None}}}}}
+MEDICAL_HISTORY_PROJECTION = {"data": {
+    "EvnType": None, "objectSetDate": None, "objectDisDate": None, "MedPersonal_id": None,
+    "EvnClass_Name": None, "Diag_Code": None, "Diag_Name": None,
+    "children": {"Evn_id": None, "MedStaffFact_id": None},
+}}
+PAY_TYPE_PROJECTION = {"PayType_id": None}
 
-@alru_cache(maxsize=1024)
-async def _fetch_person_id_from_api(
+
+@cached(
+    "person_id", ttl=settings.CACHE_TTL_PERSON_ID, maxsize=settings.CACHE_MAXSIZE_PERSON_ID,
+    should_cache=lambda person_id: person_id != constants.PERSON_ID_STATUS_API_ERROR,
+    # На диск сохраняем только найденных пациентов, а "не найден" и "двойники" в памяти
+    # хранятся недолго: новые регистрации не должны теряться
+    persistent_ttl=settings.CACHE_PERSISTENT_TTL_PERSON_ID, should_persist=is_person_id_valid,
+    ttl_for=lambda person_id: None if is_person_id_valid(person_id) else settings.CACHE_TTL_PERSON_ID_NEGATIVE
+)
+@instrumented("person_id")
+async def fetch_person_id(
         service: GatewayService, last_name: str, first_name: str, middle_name: str, birth_day: str
 ) -> str:
     payload = {
@@ -27,6 +59,7 @@ async def _fetch_person_id_from_api(
         response_json = await service.make_request(
             method='post',
             json=payload,
+            projection=PERSON_SEARCH_PROJECTION,
         )
 
         if not response_json:
@@ -49,21 +82,46 @@ async def _fetch_person_id_from_api(
         return constants.PERSON_ID_STATUS_API_ERROR
 
 
-async def fetch_person_id(service: GatewayService, data: dict) -> dict:
-    person = data["person"]
+@instrumented("person_search_batch")
+async def search_persons(service: GatewayService, last_name: str) -> list | None:
+    """
+    Пакетный поиск пациентов по фамилии (остальные поля запроса те же, что при поиске
+    пациента по ФИО, но пустые — как отчество у пациентов без отчества).
+    Возвращает строки грида или None, если запрос не удался или ответ неполный
+    (найдено больше записей, чем вернул шлюз).
+    """
+    payload = {
+        "params": {"c": "Person", "m": "getPersonSearchGrid", "_dc": datetime.now().timestamp()},
+        "data": {
+            "PersonSurName_SurName": last_name, "PersonFirName_FirName": "",
+            "PersonSecName_SecName": "", "PersonBirthDay_BirthDay": "",
+            "showAll": 1, "searchMode": "all", "allowOverLimit": 1, "page": 1, "start": 0, "limit": 100
+        }
+    }
 
-    person_id = await _fetch_person_id_from_api(
-        service=service,
-        last_name=person["last_name"],
-        first_name=person["first_name"],
-        middle_name=person["middle_name"],
-        birth_day=person["birth_day"]
-    )
-    person["id"] = person_id
-    return data
+    try:
+        response_json = await service.make_request(method='post', json=payload, projection=PERSON_SEARCH_PROJECTION)
+    except GatewayConnectivityError as e:
+        logger.error(f"Перехвачена ошибка подключения при пакетном поиске ('{last_name}'): {e}")
+        raise e
+    except Exception as e:
+        logger.error(f"Ошибка при пакетном поиске пациентов ('{last_name}'): {e}")
+        return None
+
+    if not response_json or "totalCount" not in response_json:
+        return None
+    rows = response_json.get("data") or []
+    if response_json["totalCount"] > len(rows):
+        return None
+    return rows
 
 
-@alru_cache(maxsize=1024)
+@cached(
+    "test_data", ttl=settings.CACHE_TTL_TEST_DATA, maxsize=settings.CACHE_MAXSIZE_TEST_DATA,
+    should_cache=bool,  # пустой список может означать ошибку запроса
+    persistent_ttl=settings.CACHE_PERSISTENT_TTL_TEST_DATA
+)
+@instrumented("test_data")
 async def fetch_test_data_from_evmias(service: GatewayService, test_code: str) -> list:
     """
     Получает данные об услуге по ее коду из ЕВМИАС.
@@ -86,17 +144,22 @@ async def fetch_test_data_from_evmias(service: GatewayService, test_code: str) -
         }
     }
     try:
-        response_json = await service.make_request(method='post', json=payload)
+        response_json = await service.make_request(method='post', json=payload, projection=TEST_DATA_PROJECTION)
         return response_json.get("data", [])
+    except GatewayConnectivityError:
+        # Шлюз недоступен (в т.ч. отклонено circuit breaker): задача должна завершиться ошибкой
+        raise
     except Exception as e:
         logger.error(f"Ошибка при запросе данных для теста '{test_code}': {e}")
         return []
 
 
-@alru_cache(maxsize=1024)
-async def fetch_person_tests_history(service: GatewayService, person_id: str) -> list:
+@cached("tests_history", ttl=settings.CACHE_TTL_TESTS_HISTORY, maxsize=settings.CACHE_MAXSIZE_TESTS_HISTORY)
+@instrumented("tests_history")
+async def fetch_person_tests_history(service: GatewayService, person_id: str) -> list | None:
     """
     Получает историю лабораторных исследований для пациента по его ID.
+    Возвращает None при ошибке запроса.
     """
     payload = {
         "params": {
@@ -112,14 +175,18 @@ async def fetch_person_tests_history(service: GatewayService, person_id: str) ->
         }
     }
     try:
-        response_json = await service.make_request(method='post', json=payload)
+        response_json = await service.make_request(method='post', json=payload, projection=TESTS_HISTORY_PROJECTION)
         return response_json.get("data", [])
+    except GatewayConnectivityError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при запросе истории анализов для person_id '{person_id}': {e}")
-        return []
+        # None не кешируется, в отличие от пустой истории
+        return None
 
 
-@alru_cache(maxsize=2048)
+@cached("test_report", ttl=settings.CACHE_TTL_TEST_REPORT, maxsize=settings.CACHE_MAXSIZE_TEST_REPORT)
+@instrumented("test_report")
 async def fetch_test_report(service: GatewayService, event_id: str) -> dict | None:
     payload = {
         "params": {
@@ -141,14 +208,19 @@ async def fetch_test_report(service: GatewayService, event_id: str) -> dict | No
         }
     }
     try:
-        response_json = await service.make_request(method='post', json=payload)
+        response_json = await service.make_request(method='post', json=payload, projection=TEST_REPORT_PROJECTION)
         return response_json
+    except GatewayConnectivityError:
+        raise
     except Exception as e:
-        print(f"Ошибка при запросе отчета для event_id '{event_id}': {e}")
+        logger.error(f"Ошибка при запросе отчета для event_id '{event_id}': {e}")
         return None
 
 
-@alru_cache(maxsize=1024) # Кешируем по person_id
+@cached(  # Кешируем по person_id
+    "medical_history", ttl=settings.CACHE_TTL_MEDICAL_HISTORY, maxsize=settings.CACHE_MAXSIZE_MEDICAL_HISTORY
+)
+@instrumented("medical_history")
 async def fetch_medical_history(service: GatewayService, person_id: str) -> dict | None:
     """
     Получает общую медицинскую историю пациента (EMK).
@@ -164,18 +236,24 @@ async def fetch_medical_history(service: GatewayService, person_id: str) -> dict
             "userMedStaffFact_id": "3010101000069712",
             "userLpuUnitType_SysNick": "polka",
             # Список запрашиваемых типов событий
-            "evnClassList": '["EvnPLDispDop13","EvnUslugaPar","EvnDirection","_EvnLabSample","EvnPL",'\
-                            '"_EvnLabRequest","EvnVaccination","CmpCard","DispRefuse","ReturnEvnPrescrMse","OuterRegistry"]'
+            "evnClassList": json.dumps(
+                constants.MEDICAL_HISTORY_VISIT_EVN_CLASSES if settings.MEDICAL_HISTORY_VISITS_ONLY
+                else constants.MEDICAL_HISTORY_EVN_CLASSES,
+                separators=(",", ":")
+            )
         }
     }
     try:
-        return await service.make_request(method='post', json=payload)
+        return await service.make_request(method='post', json=payload, projection=MEDICAL_HISTORY_PROJECTION)
+    except GatewayConnectivityError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при запросе мед. истории для person_id '{person_id}': {e}")
         return None
 
 
-@alru_cache(maxsize=2048) # Кешируем по event_id
+@cached("pay_type", ttl=settings.CACHE_TTL_PAY_TYPE, maxsize=settings.CACHE_MAXSIZE_PAY_TYPE)  # Кешируем по event_id
+@instrumented("pay_type")
 async def fetch_pay_type_id(service: GatewayService, evn_id: str) -> str | None:
     """
     Получает PayType_id для конкретного события посещения.
@@ -190,11 +268,13 @@ async def fetch_pay_type_id(service: GatewayService, evn_id: str) -> str | None:
         }
     }
     try:
-        response_json = await service.make_request(method='post', json=payload)
+        response_json = await service.make_request(method='post', json=payload, projection=PAY_TYPE_PROJECTION)
         # Ответ приходит в виде списка из одного словаря
         if response_json and isinstance(response_json, list):
             return response_json[0].get("PayType_id")
         return None
+    except GatewayConnectivityError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при запросе типа оплаты для evn_id '{evn_id}': {e}")
         return None
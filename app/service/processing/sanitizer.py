@@ -1,4 +1,6 @@
 import datetime as dt
+import sys
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
 from typing import Any
 
@@ -8,6 +10,7 @@ from app.core.logger_setup import logger
 from app.service.processing.tool import is_person_id_valid
 from . import constants
 from .pay_type_mapper import PAY_TYPE_IDS
+from .record import Person, Record, TestSource, is_set
 
 
 def _sanitize_float(value: Any) -> float:
@@ -36,11 +39,11 @@ def sanitize_for_report(data: list) -> list[dict]:
     """
     result = []
     for row in data:
-        person = row.get("person", {})
-        test_src = row.get("test_src", {})
-        test_evmias = row.get("test_evmias")
-        test_report = row.get("test_report")
-        person_id = person.get("id")
+        person = row.person
+        test_src = row.test_src
+        test_evmias = row.test_evmias if is_set(row.test_evmias) else None
+        test_report = row.test_report if is_set(row.test_report) else None
+        person_id = person.id
 
         # Переменные для финального отчета
         final_pay_type = ""
@@ -54,7 +57,7 @@ def sanitize_for_report(data: list) -> list[dict]:
         elif person_id == constants.PERSON_ID_STATUS_API_ERROR:
             final_comment = "Ошибка API при поиске пациента"
         elif not test_evmias:
-            final_comment = constants.COMMENT_SERVICE_NOT_FOUND.format(test_src.get('code', ''))
+            final_comment = constants.COMMENT_SERVICE_NOT_FOUND.format(test_src.code)
         elif not test_report:
             final_comment = constants.COMMENT_RESULTS_NOT_FOUND
         else:
@@ -63,18 +66,18 @@ def sanitize_for_report(data: list) -> list[dict]:
         # ИСПРАВЛЕНИЕ: Создаем ПЛОСКИЙ словарь
         result.append({
             # Данные пациента на верхнем уровне
-            'last_name': person.get('last_name', ''),
-            'first_name': person.get('first_name', ''),
-            'middle_name': person.get('middle_name', ''),
-            'birth_day': person.get('birth_day', ''),
+            'last_name': person.last_name,
+            'first_name': person.first_name,
+            'middle_name': person.middle_name,
+            'birth_day': person.birth_day,
 
             # Остальные данные
-            "visit_date": row.get("visit_date", ""),
-            "inz": row.get("inz", ""),
-            "test_code": test_src.get("code", ""),
-            "test_name": test_src.get("name", ""),
-            "test_quantity": test_src.get("quantity", 0),
-            "test_price": test_src.get("price", 0.0),
+            "visit_date": row.visit_date,
+            "inz": row.inz,
+            "test_code": test_src.code,
+            "test_name": test_src.name,
+            "test_quantity": test_src.quantity,
+            "test_price": test_src.price,
 
             # Результаты анализа
             'test_pay_type': final_pay_type,  # Используем ключ, который ожидает make_report
@@ -87,31 +90,55 @@ def sanitize_for_report(data: list) -> list[dict]:
     return result
 
 
-def sanitize_medical_history(raw_data: dict, visit_date: str):
-    data = raw_data.get("data", {})
-    visit_date = datetime.strptime(visit_date, '%d.%m.%Y')
-    border_date = visit_date - timedelta(days=14)
-    result = []
-    if data:
-        for each in data:
-            if each["EvnType"] not in ["direction", "par", "disp"]:
-                set_date = datetime.strptime(each["objectSetDate"], '%d.%m.%Y')
-                if border_date < set_date <= visit_date:
-                    evn_id = each["children"][0].get("Evn_id")
-
-                    sanitized_each = {
-                        "date_set": each["objectSetDate"],
-                        "date_dis": each["objectDisDate"],
-                        "med_personal_id": each["MedPersonal_id"],
-                        "evn_class_name": each["EvnClass_Name"],
-                        "diag_code": each["Diag_Code"],
-                        "diag_name": each["Diag_Name"],
-                        "evn_type": each["EvnType"],
-                        "children_evn_id": evn_id,
-                        "med_staff_fact_id": each["children"][0]["MedStaffFact_id"]
-                    }
-                    result.append(sanitized_each)
-    return result
+# Типы событий мед. истории, по которым тип оплаты не определяется
+_MEDICAL_HISTORY_SKIPPED_TYPES = ("direction", "par", "disp")
+_MEDICAL_HISTORY_WINDOW = timedelta(days=14)
+
+
+def _sanitize_medical_event(each: dict) -> dict:
+    return {
+        "date_set": each["objectSetDate"],
+        "date_dis": each["objectDisDate"],
+        "med_personal_id": each["MedPersonal_id"],
+        "evn_class_name": each["EvnClass_Name"],
+        "diag_code": each["Diag_Code"],
+        "diag_name": each["Diag_Name"],
+        "evn_type": each["EvnType"],
+        "children_evn_id": each["children"][0].get("Evn_id"),
+        "med_staff_fact_id": each["children"][0]["MedStaffFact_id"]
+    }
+
+
+class MedicalHistoryIndex:
+    """
+    Мед. история пациента, разобранная один раз для всех его записей:
+    подходящие события, отсортированные по дате. Окно для даты визита ищется бисекцией.
+    """
+    __slots__ = ("_dates", "_entries")
+
+    def __init__(self, raw_data: dict | None):
+        data = (raw_data or {}).get("data") or []
+        # (дата, позиция в истории, событие)
+        self._entries = sorted(
+            (datetime.strptime(each["objectSetDate"], '%d.%m.%Y'), position, each)
+            for position, each in enumerate(data)
+            if each["EvnType"] not in _MEDICAL_HISTORY_SKIPPED_TYPES
+        )
+        self._dates = [entry[0] for entry in self._entries]
+
+    def first_event(self, visit_date: str) -> dict | None:
+        """
+        Первое в порядке истории событие в окне (дата визита - 14 дней, дата визита]
+        (то же, что дал бы последовательный перебор истории) или None.
+        """
+        if not self._entries:
+            return None
+        visit_date = datetime.strptime(visit_date, '%d.%m.%Y')
+        start = bisect_right(self._dates, visit_date - _MEDICAL_HISTORY_WINDOW)
+        end = bisect_right(self._dates, visit_date)
+        if start == end:
+            return None
+        return _sanitize_medical_event(min(self._entries[start:end], key=lambda entry: entry[1])[2])
 
 
 def sanitize_test_info(data: dict) -> dict[str, Any] | None:
@@ -137,46 +164,89 @@ def _sanitize_history_item(data: list) -> list:
     return result
 
 
+class _TestsHistoryIndex:
+    """
+    История анализов пациента, разобранная один раз для всех его записей:
+    очищенный список и индекс по `test_id` с отсортированными временами событий.
+    """
+    __slots__ = ("items", "_by_test", "_times")
+
+    def __init__(self, raw_history: list):
+        self.items = _sanitize_history_item(raw_history)
+        self._by_test = {}
+        for item in self.items:
+            self._by_test.setdefault(item.get("test_id"), []).append(item)
+        self._times = {}
+
+    def _sorted_times(self, test_id) -> tuple | None:
+        """
+        Времена событий теста, отсортированные по (времени, позиции в истории),
+        и события в том же порядке; None, если какое-то время не разбирается.
+        """
+        if test_id not in self._times:
+            try:
+                entries = sorted(
+                    (datetime.strptime(item['sort'], '%Y-%m-%d %H:%M:%S'), position, item)
+                    for position, item in enumerate(self._by_test[test_id])
+                )
+            except ValueError:
+                self._times[test_id] = None
+            else:
+                self._times[test_id] = ([entry[0] for entry in entries], entries)
+        return self._times[test_id]
+
+    def find(self, test_id, visit_date: str):
+        """
+        События теста: пустой список, список из одного события или, если событий несколько,
+        ближайшее к дате визита (при равенстве — первое в истории).
+        Если время какого-то события не разбирается, возвращаются все события теста.
+        """
+        matches = self._by_test.get(test_id, [])
+        if len(matches) <= 1:
+            return list(matches)
+
+        visit_date = datetime.strptime(visit_date, '%d.%m.%Y')
+        sorted_times = self._sorted_times(test_id)
+        if sorted_times is None:
+            return list(matches)
+        times, entries = sorted_times
+        index = bisect_left(times, visit_date)
+        candidates = []
+        if index < len(times):
+            # bisect_left дает первое событие с этим временем, т.е. с наименьшей позицией
+            candidates.append(entries[index])
+        if index > 0:
+            candidates.append(entries[bisect_left(times, times[index - 1])])
+        nearest = min(candidates, key=lambda entry: (abs(entry[0] - visit_date), entry[1]))
+        return nearest[2]
+
+
 def sanitize_persons_tests_history(data: list) -> list:
+    # Индекс строится один раз на историю пациента (один объект списка на всех его записях)
+    indexes = {}
     result = []
     for row in data:
-        person_id = row.get("person", {}).get("id")
+        person_id = row.person.id
         if not is_person_id_valid(person_id):
             result.append(row)
             continue
-        test_history = row.get("tests_history")
-        sanitize_history = _sanitize_history_item(test_history)
+        test_history = row.tests_history if is_set(row.tests_history) else None
+        if id(test_history) not in indexes:
+            indexes[id(test_history)] = (test_history, _TestsHistoryIndex(test_history))
+        history_index = indexes[id(test_history)][1]
         try:
-            test = row.get("test_evmias", None)
+            test = row.test_evmias if is_set(row.test_evmias) else None
             if test is not None:
                 test_id = test.get("id")
 
-                if test_id is not None and isinstance(sanitize_history, list):
-                    filtered_history = [
-                        history_item for history_item in sanitize_history
-                        if history_item.get("test_id") == test_id
-                    ]
-
-                    if len(filtered_history) > 1:
-                        visit_date = row.get("visit_date")
-                        visit_date = datetime.strptime(visit_date, '%d.%m.%Y')
-                        try:
-                            filtered_history = min(
-                                filtered_history,
-                                key=lambda record: abs(
-                                    datetime.strptime(record['sort'], '%Y-%m-%d %H:%M:%S') - visit_date)
-                            )
-                        except ValueError:
-                            pass
-                            # print(row['person'])
-                            # print(json.dumps(filtered_history, indent=4, ensure_ascii=False))
-                    row["tests_history"] = filtered_history
+                if test_id is not None:
+                    row.tests_history = history_index.find(test_id, row.visit_date)
             else:
-                row["tests_history"] = sanitize_history
+                row.tests_history = history_index.items
             result.append(row)
 
         except (TypeError, AttributeError):
-            row["tests_history"] = sanitize_history
+            row.tests_history = history_index.items
             result.append(row)
             continue
 
@@ -270,28 +340,55 @@ def _sanitize_name(raw_name: str) -> list[str]:
     return name_parts
 
 
-def sanitize_raw_data(data):
+def _memoized(func):
+    """
+    Кеш результатов `func` на время одного вызова `sanitize_raw_data`:
+    в выгрузке одни и те же ФИО, даты рождения и цены повторяются в тысячах строк.
+    """
+    results = {}
+
+    def wrapper(value):
+        try:
+            return results[value]
+        except KeyError:
+            result = results[value] = func(value)
+            return result
+
+    return wrapper
+
+
+def sanitize_raw_data(data) -> list[Record]:
+    """
+    Преобразует строки выгрузки в записи для обработки.
+    Каждое уникальное значение ФИО, даты рождения, количества и цены разбирается один раз,
+    записи одного пациента разделяют общий объект `Person`, а одинаковые строки — общие объекты str.
+    """
+    persons = {}
+
+    def make_person(raw_person: tuple) -> Person:
+        full_name, raw_birthday = raw_person
+        last, first, middle = (sys.intern(part) for part in _sanitize_name(full_name))
+        person = Person(last, first, middle, sanitize_birthday(raw_birthday))
+        return persons.setdefault(person.key, person)
+
+    get_person = _memoized(make_person)
+    sanitize_birthday = _memoized(lambda raw_birthday: sys.intern(_sanitize_birthday(raw_birthday)))
+    sanitize_quantity = _memoized(lambda value: int(_sanitize_float(value)))
+    sanitize_price = _memoized(_sanitize_float)
+    shared = _memoized(lambda value: value)
+
     sanitized = []
     for row in data:
-        # logger.debug(row)
         visit_date, raw_birthday, inz, full_name, test_code, test_name, test_quantity, test_price = row
-        last, first, middle = _sanitize_name(full_name)
-        birthday = _sanitize_birthday(raw_birthday)
-
-        sanitized.append({
-            "inz": inz,
-            "visit_date": visit_date,
-            "person": {
-                "last_name": last,
-                "first_name": first,
-                "middle_name": middle,
-                "birth_day": birthday
-            },
-            "test_src": {
-                "code": test_code,
-                "name": test_name,
-                "quantity": int(_sanitize_float(test_quantity)),
-                "price": _sanitize_float(test_price)
-            }
-        })
+        sanitized.append(Record(
+            inz=inz,
+            visit_date=shared(visit_date),
+            person=get_person((full_name, raw_birthday)),
+            test_src=TestSource(
+                code=shared(test_code),
+                name=shared(test_name),
+                quantity=sanitize_quantity(test_quantity),
+                price=sanitize_price(test_price)
+            )
+        ))
     return sanitized
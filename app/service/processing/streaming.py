@@ -0,0 +1,126 @@
+"""
+Потоковый режим обогащения записей (`PIPELINE_MODE=streaming`).
+
+Вместо последовательных этапов по всему файлу записи группируются по пациенту,
+и каждая группа проходит цепочку
+поиск ID -> справочник услуг -> история анализов -> отчет по анализу -> мед. история
+сразу, как только готовы ее входные данные. Этапы связаны ограниченными очередями,
+поэтому первые пациенты обрабатываются полностью, не дожидаясь остальных.
+"""
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, List
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+from app.service.gateway import GatewayService
+from .executor import gather_or_cancel, shared_concurrency_limit
+from .getter import (
+    get_ids,
+    resolve_person_batches,
+    get_test_data_from_evmias,
+    get_person_tests_history,
+    get_pay_type,
+    get_medical_history
+)
+from .sanitizer import sanitize_persons_tests_history
+
+settings = get_settings()
+
+# Маркер конца потока в очереди этапа
+_DONE = object()
+
+
+def _group_by_person(data: list) -> List[list]:
+    """Группирует записи по пациенту (ФИО + дата рождения), сохраняя порядок появления."""
+    groups = {}
+    for row in data:
+        groups.setdefault(row.person.key, []).append(row)
+    return list(groups.values())
+
+
+def _enrichment_stages(service: GatewayService, task_id: str) -> List[Callable[[list], Awaitable[list]]]:
+    """Этапы обогащения группы записей; без `manager` этапы не отправляют собственный прогресс."""
+    async def sanitize_history(rows: list) -> list:
+        return await run_in_threadpool(sanitize_persons_tests_history, rows)
+
+    def stage(getter):
+        async def run(rows: list) -> list:
+            return await getter(service, rows, task_id=task_id, manager=None, start_progress=0, end_progress=0)
+        return run
+
+    return [
+        # Пакетный поиск ID выполняется заранее по всему файлу (`run_streaming_enrichment`)
+        stage(partial(get_ids, batch=False)),
+        stage(get_test_data_from_evmias),
+        stage(get_person_tests_history),
+        sanitize_history,
+        stage(get_pay_type),
+        stage(get_medical_history),
+    ]
+
+
+async def run_streaming_enrichment(
+        service: GatewayService, data: list,
+        task_id: str, manager,
+        start_progress: int, end_progress: int
+) -> list:
+    """
+    Обогащает записи в потоковом режиме. Записи изменяются на месте,
+    порядок и итоговое содержимое совпадают с последовательным режимом.
+    """
+    groups = _group_by_person(data)
+    total = len(groups)
+    if total == 0:
+        return data
+
+    # В группе один пациент, поэтому пакетный поиск ID в потоке не работает:
+    # он выполняется до запуска потока для всех пациентов файла
+    batch_progress = start_progress + (end_progress - start_progress) // 10
+    await resolve_person_batches(
+        service, data, task_id=task_id, manager=manager,
+        start_progress=start_progress, end_progress=batch_progress
+    )
+    start_progress = batch_progress
+
+    stages = _enrichment_stages(service, task_id)
+    workers_per_stage = settings.PROCESSING_CONCURRENCY
+    queues = [asyncio.Queue(maxsize=settings.STREAMING_QUEUE_SIZE) for _ in range(len(stages) + 1)]
+    progress_span = end_progress - start_progress
+    done = 0
+
+    async def feed():
+        for group in groups:
+            await queues[0].put(group)
+        for _ in range(workers_per_stage):
+            await queues[0].put(_DONE)
+
+    async def run_stage(index: int):
+        process, in_queue, out_queue = stages[index], queues[index], queues[index + 1]
+
+        async def worker():
+            while (group := await in_queue.get()) is not _DONE:
+                await out_queue.put(await process(group))
+
+        await gather_or_cancel([asyncio.create_task(worker()) for _ in range(workers_per_stage)])
+        next_workers = workers_per_stage if index + 1 < len(stages) else 1
+        for _ in range(next_workers):
+            await out_queue.put(_DONE)
+
+    async def collect():
+        nonlocal done
+        while await queues[-1].get() is not _DONE:
+            done += 1
+            await manager.send_progress(task_id, {
+                "progress": start_progress + int((done / total) * progress_span),
+                "detail": f"Обработано пациентов: {done} из {total}"
+            })
+
+    # Все этапы делят общий лимит одновременных запросов к шлюзу
+    with shared_concurrency_limit(settings.PROCESSING_CONCURRENCY):
+        await gather_or_cancel(
+            [asyncio.create_task(feed()), asyncio.create_task(collect())]
+            + [asyncio.create_task(run_stage(index)) for index in range(len(stages))]
+        )
+    return data
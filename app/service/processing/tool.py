@@ -1,11 +1,24 @@
+import gzip
 import json
 from pathlib import Path
-from openpyxl import load_workbook, worksheet
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Alignment, PatternFill
 
 from . import constants
 
+# Необязательные ускорители: orjson для (де)сериализации, zstandard для сжатия контрольных точек
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 CENTER_ALIGNED = Alignment(horizontal='center', vertical='center')
 
 
@@ -23,80 +36,118 @@ def save_json(data, filename):
         json.dump(data, file, ensure_ascii=False, indent=2)
 
 
-def _align_column_center(sheet: worksheet, columns: list):
-    for column_to_align in columns:
-        for cell in sheet[column_to_align]:
-            cell.alignment = CENTER_ALIGNED
+def _json_default(obj):
+    """Объекты с `as_dict()` (записи pipeline) сериализуются как словари."""
+    if hasattr(obj, "as_dict"):
+        return obj.as_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dump_json_bytes(data, pretty: bool = False) -> bytes:
+    """Сериализует данные в JSON (UTF-8); через orjson, если он установлен."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(data, default=_json_default, option=option)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2, default=_json_default).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+def compress_bytes(payload: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=5)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    return payload
+
+
+def load_json(filename):
+    """Читает JSON, в т.ч. сжатый (`.json.gz`, `.json.zst`)."""
+    payload = Path(filename).read_bytes()
+    suffix = Path(filename).suffix
+    if suffix == ".gz":
+        payload = gzip.decompress(payload)
+    elif suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"Файл {Path(filename).name} сжат zstd, но пакет zstandard не установлен")
+        payload = zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+REPORT_SHEET_TITLE = "Для работы"
+REPORT_HEADERS = [
+    "Дата взятия", "ИНЗ", "ФИО", "Дата рождения", "Код теста",
+    "Название теста", "Кол-во", "Цена", "Оплата", "Комментарий"
+]
+# Индексы (с 0) колонок A, B, D, выравниваемых по центру, и колонки цены H
+CENTER_ALIGNED_COLUMNS = {0, 1, 3}
+PRICE_COLUMN = 7
+INVALID_FILL = PatternFill(start_color="FFFFC7CE", end_color="FFFFC7CE", fill_type="solid")
+
+
+def _report_row(each: dict) -> list:
+    name = f"{each.get('last_name', '')} {each.get('first_name', '')} {each.get('middle_name', '')}".strip()
+    return [
+        each.get("visit_date", ""),
+        each.get("inz", ""),
+        name,
+        each.get("birth_day", ""),
+        each.get("test_code", ""),
+        each.get("test_name", ""),
+        each.get("test_quantity", 0),
+        each.get("test_price", 0.0),
+        each.get("test_pay_type", ""),
+        each.get("comment", ""),
+    ]
 
 
-def _align_row_center(sheet: worksheet, rows: list):
-    for row_to_align in rows:
-        for cell in sheet[row_to_align]:
+def _styled_row(sheet, values: list, highlight: bool, is_header: bool = False) -> list:
+    """Оборачивает значения строки в ячейки write-only листа с нужными стилями."""
+    cells = []
+    for index, value in enumerate(values):
+        if not (highlight or is_header or index in CENTER_ALIGNED_COLUMNS or index == PRICE_COLUMN):
+            cells.append(value)
+            continue
+        cell = WriteOnlyCell(sheet, value=value)
+        if is_header or index in CENTER_ALIGNED_COLUMNS:
             cell.alignment = CENTER_ALIGNED
-
-
-def _auto_cells_width(sheet):
-    for col in sheet.columns:
-        max_length = 0
-        col_letter = get_column_letter(col[0].column)
-        for cell in col:
-            if cell.value:
-                max_length = max(max_length, len(str(cell.value)))
-        sheet.column_dimensions[col_letter].width = max_length + 4
+        if highlight:
+            cell.fill = INVALID_FILL
+        if index == PRICE_COLUMN and not is_header:
+            cell.number_format = constants.PRICE_FORMAT
+        cells.append(cell)
+    return cells
 
 
 def make_report(data: list[dict], filename: str | Path):
-    book = load_workbook(filename)
-    if "Для работы" in book.sheetnames:
-        book.remove(book["Для работы"])
-    sheet = book.create_sheet("Для работы")
-
-    headers = [
-        "Дата взятия", "ИНЗ", "ФИО", "Дата рождения", "Код теста",
-        "Название теста", "Кол-во", "Цена", "Оплата", "Комментарий"
-    ]
-    sheet.append(headers)
-
-    invalid_fill = PatternFill(start_color="FFFFC7CE", end_color="FFFFC7CE", fill_type="solid")
-
+    """
+    Формирует отчет отдельной книгой с листом "Для работы" в режиме write-only.
+
+    Значения строк и ширина колонок вычисляются за один проход по данным;
+    стили (выравнивание, заливка, формат цены) задаются ячейкам при записи,
+    без повторных обходов листа.
+    """
+    widths = [len(header) for header in REPORT_HEADERS]
+    rows = []
     for each in data:
-        name = f"{each.get('last_name', '')} {each.get('first_name', '')} {each.get('middle_name', '')}".strip()
-
-        row_to_append = [
-            each.get("visit_date", ""),
-            each.get("inz", ""),
-            name,
-            each.get("birth_day", ""),
-            each.get("test_code", ""),
-            each.get("test_name", ""),
-            each.get("test_quantity", 0),
-            each.get("test_price", 0.0),
-            each.get("test_pay_type", ""),
-            each.get("comment", ""),
-        ]
-        sheet.append(row_to_append)
-
-        # Красим строку, если есть комментарий
-        if each.get("comment"):
-            current_row = sheet.max_row
-            for cell in sheet[current_row]:
-                cell.fill = invalid_fill
-
-    # автоширина всех колонок
-    _auto_cells_width(sheet)
+        values = _report_row(each)
+        for index, value in enumerate(values):
+            if value:
+                widths[index] = max(widths[index], len(str(value)))
+        rows.append((values, bool(each.get("comment"))))
 
-    # выравнивание строк по центру
-    rows_to_align = [1]
-    _align_row_center(sheet, rows_to_align)
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet(REPORT_SHEET_TITLE)
 
-    # выравнивание колонок по центру
-    columns_to_align = ["A", "B", "D"]
-    _align_column_center(sheet, columns_to_align)
+    # автоширина всех колонок (в write-only режиме задается до записи строк)
+    for index, width in enumerate(widths, start=1):
+        sheet.column_dimensions[get_column_letter(index)].width = width + 4
 
-    # задаем формат ячейки 0,00
-    price_column = 'H'
-    for cell in sheet[price_column][1:]:
-        cell.number_format = constants.PRICE_FORMAT
+    sheet.append(_styled_row(sheet, REPORT_HEADERS, highlight=False, is_header=True))
+    for values, highlight in rows:
+        # Красим строку, если есть комментарий
+        sheet.append(_styled_row(sheet, values, highlight))
 
     book.save(filename)
-    book.close()
@@ -0,0 +1,120 @@
+"""
+Проекции ответов шлюза: из ответа оставляются только поля, которые использует приложение.
+
+Проекция задается вложенным словарем `{поле: вложенная проекция или None}`:
+`None` — поле сохраняется целиком, словарь — сохраняются только перечисленные поля.
+Списки прозрачны: проекция применяется к каждому элементу. Например,
+`{"data": {"Evn_id": None, "children": {"Evn_id": None}}}`.
+
+Разбор ответа (`GATEWAY_JSON_PARSER`):
+  ijson  — потоковый: объекты строятся сразу усеченными, полный ответ
+           не создается в памяти в виде объектов Python (медленнее orjson);
+  orjson — быстрый разбор целиком, затем проекция;
+  json   — стандартная библиотека;
+  auto   — ответы от `STREAM_MIN_SIZE` байт разбираются ijson (если установлен с C-бэкендом),
+           остальные — orjson, а без него json.
+"""
+import json
+from typing import Any, Dict, Optional
+
+from app.core import get_settings, logger
+
+# Необязательные ускорители разбора JSON
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+Projection = Optional[Dict[str, Any]]
+
+_PARSERS = ("ijson", "orjson", "json")
+# Размер ответа, начиная с которого в режиме auto используется потоковый разбор
+STREAM_MIN_SIZE = 256 * 1024
+
+
+def _select_parser(name: str) -> str:
+    if name == "auto":
+        return name
+    if name not in _PARSERS:
+        logger.warning(f"Неизвестный GATEWAY_JSON_PARSER={name}: используется json")
+        return "json"
+    if (name == "ijson" and ijson is None) or (name == "orjson" and orjson is None):
+        fallback = "orjson" if orjson is not None else "json"
+        logger.warning(f"GATEWAY_JSON_PARSER={name}, но пакет {name} не установлен: используется {fallback}")
+        return fallback
+    return name
+
+
+parser = _select_parser(get_settings().GATEWAY_JSON_PARSER)
+_fast_parser = "orjson" if orjson is not None else "json"
+_can_stream = ijson is not None and ijson.backend in ("yajl2_c", "yajl2_cffi")
+
+
+def project(value, projection: Projection):
+    """Применяет проекцию к уже разобранному JSON."""
+    if projection is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, projection) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], projection[key]) for key in projection if key in value}
+    return value
+
+
+def _parse_projected_stream(content: bytes, projection: Projection):
+    """Потоковый разбор: значения ключей вне проекции пропускаются, не создавая объектов."""
+    builder = ijson.ObjectBuilder()
+    # Открытые контейнеры: (это объект, проекция контейнера)
+    stack = []
+    # Проекция значения после последнего ключа объекта
+    value_node = projection
+    # Пропуск значения исключенного ключа: глубина вложенности внутри него
+    skipping, skip_depth = False, 0
+    for _, event, value in ijson.parse(content, use_float=True):
+        if skipping:
+            if event in ("start_map", "start_array"):
+                skip_depth += 1
+            elif event in ("end_map", "end_array"):
+                skip_depth -= 1
+            skipping = skip_depth > 0
+            continue
+
+        if event == "map_key":
+            node = stack[-1][1]
+            if node is not None:
+                if value not in node:
+                    skipping, skip_depth = True, 0
+                    continue
+                node = node[value]
+            value_node = node
+        elif event in ("start_map", "start_array"):
+            # Элементы массива получают проекцию самого массива
+            node = value_node if not stack or stack[-1][0] else stack[-1][1]
+            stack.append((event == "start_map", node))
+        elif event in ("end_map", "end_array"):
+            stack.pop()
+        builder.event(event, value)
+    return builder.value
+
+
+def parse_response(content: bytes, projection: Projection = None):
+    """Разбирает тело ответа шлюза, оставляя только поля из проекции."""
+    if not content:
+        return {}
+    selected = parser
+    if selected == "auto":
+        selected = "ijson" if _can_stream and len(content) >= STREAM_MIN_SIZE else _fast_parser
+    if selected == "ijson" and projection is not None:
+        try:
+            return _parse_projected_stream(content, projection)
+        except ijson.JSONError as exc:
+            # Как и при обычном разборе, некорректный JSON — ValueError
+            raise ValueError(f"Некорректный JSON в ответе шлюза: {exc}") from exc
+    if selected == "orjson" or (selected == "ijson" and orjson is not None):
+        return project(orjson.loads(content), projection)
+    return project(json.loads(content), projection)
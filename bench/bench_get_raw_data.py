@@ -0,0 +1,97 @@
+"""
+Сравнение чтения выгрузки: полная загрузка книги (прежняя реализация) и
+потоковое чтение в режиме read-only (`get_raw_data`). Время включает преобразование
+строк в записи (`sanitize_raw_data`), которое в потоковом варианте идет по мере чтения.
+
+Каждый вариант запускается в отдельном процессе, чтобы пиковый RSS был честным.
+
+    python -m bench.bench_get_raw_data --rows 50000
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.common import setup_env, make_invitro_workbook, peak_rss_mb
+
+setup_env()
+
+
+def _full_load(book_path: Path, start_row: int, max_col: int, min_col: int = 2) -> list:
+    """Прежняя реализация `get_raw_data`: книга целиком загружается в память."""
+    from openpyxl import load_workbook
+    from app.service.processing.getter import to_ddmmyyyy
+
+    book = load_workbook(book_path)
+    sheet = book.active
+    visit_date, patient_birthday = None, None
+    processed_data, seen_rows = [], set()
+    for row in sheet.iter_rows(min_row=start_row, min_col=min_col, max_col=max_col, values_only=True):
+        row = [item for item in row if item is not None]
+        if not row: break
+        if len(row) == 1:
+            visit_date = row[0].strftime('%d.%m.%Y') if hasattr(row[0], 'strftime') else str(row[0])
+        elif len(row) == 2:
+            patient_birthday = row[0].strftime('%d.%m.%Y') if hasattr(row[0], 'strftime') else str(row[0])
+        elif len(row) > 2:
+            if visit_date and patient_birthday:
+                combined_row = [to_ddmmyyyy(visit_date), to_ddmmyyyy(patient_birthday)] + [to_ddmmyyyy(x) for x in row]
+                row_tuple = tuple(combined_row)
+                if row_tuple not in seen_rows:
+                    processed_data.append(combined_row)
+                    seen_rows.add(row_tuple)
+    book.close()
+    return processed_data
+
+
+def _run_variant(variant: str, book_path: Path):
+    from app.service.processing.getter import get_raw_data
+    from app.service.processing.sanitizer import sanitize_raw_data
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    if variant == "full":
+        rows = _full_load(book_path, 2, 9)
+    else:
+        # Строки читаются лениво, по мере обхода в `sanitize_raw_data`, как в pipeline
+        rows = get_raw_data(book_path, 2, 9)
+    sanitized = sanitize_raw_data(rows)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "variant": variant,
+        "rows": len(sanitized),
+        "read_sec": round(elapsed, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_before_mb": round(rss_before, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--variant", choices=["full", "read_only"], help=argparse.SUPPRESS)
+    parser.add_argument("--book", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        _run_variant(args.variant, args.book)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        book_path = make_invitro_workbook(Path(tmp) / "bench.xlsx", args.rows)
+        print(f"Синтетическая выгрузка: {args.rows} строк, {book_path.stat().st_size / 1024 / 1024:.1f} МБ")
+        for variant in ("full", "read_only"):
+            output = subprocess.run(
+                [sys.executable, "-m", "bench.bench_get_raw_data", "--variant", variant, "--book", str(book_path)],
+                check=True, capture_output=True, text=True
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(f"{result['variant']:>10}: {result['rows']} строк, {result['read_sec']} с (чтение и подготовка), "
+                  f"пиковый RSS {result['peak_rss_mb']} МБ (до чтения {result['rss_before_mb']} МБ)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Сквозной бенчмарк `run_processing_pipeline` с имитацией шлюза ЕВМИАС (`bench.mock_gateway`).
+
+Генерирует синтетическую выгрузку Invitro, прогоняет pipeline в отдельном процессе
+и выводит: строк в секунду, запросов к шлюзу на строку, длительность этапов,
+p50/p99 времени ответа по методам шлюза и пиковый RSS.
+
+    python -m bench.bench_pipeline --rows 3000 --latency-ms 30 --error-rate 0.01
+    python -m bench.bench_pipeline --rows 3000 --mode streaming --json
+    python -m bench.bench_pipeline --rows 3000 --person-batch-mode surname
+
+Поиск пациентов идет по картотеке из пациентов выгрузки (`bench.mock_gateway.make_registry`),
+`--family-size` пациентов подряд носят одну фамилию, что и группирует пакетный поиск.
+
+По умолчанию шлюз работает внутри процесса (httpx.ASGITransport); с `--url`
+запросы идут к отдельно запущенному `python -m bench.mock_gateway`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.common import setup_env, make_invitro_workbook, make_patients, peak_rss_mb
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _configure_env(args):
+    """Настройки приложения читаются при импорте, поэтому задаются до него."""
+    os.environ["GATEWAY_RATE_LIMIT_RPS"] = str(args.rps)
+    os.environ["PIPELINE_MODE"] = args.mode
+    os.environ["CHECKPOINT_MODE"] = args.checkpoint_mode
+    os.environ["PROCESSING_CONCURRENCY"] = str(args.concurrency)
+    os.environ["GATEWAY_RETRY_BACKOFF_BASE"] = "0.05"
+    os.environ["CACHE_PERSISTENT_ENABLED"] = "false"
+    os.environ["PERSON_BATCH_MODE"] = args.person_batch_mode
+    setup_env()
+
+
+async def _run_pipeline(args) -> dict:
+    import shutil
+    import uuid
+    from collections import defaultdict
+
+    import httpx
+
+    from app.core.config import get_settings
+    from app.service.gateway import GatewayService
+    from app.service.processing.pipeline import RESULTS_DIR, run_processing_pipeline
+    from bench.mock_gateway import MockGatewayConfig, create_mock_gateway, make_registry
+
+    settings = get_settings()
+    latencies = defaultdict(list)
+    stage_marks = []
+    final = {}
+
+    class MeasuredGatewayService(GatewayService):
+        async def make_request(self, method: str, idempotent: bool = True, **kwargs):
+            name = kwargs["json"]["params"]["m"]
+            started = time.perf_counter()
+            try:
+                return await super().make_request(method, idempotent, **kwargs)
+            finally:
+                latencies[name].append(time.perf_counter() - started)
+
+    class BenchManager:
+        async def send_progress(self, task_id: str, message: dict):
+            if message.get("progress") in (100, -1):
+                final.update(message)
+            elif "message" in message:
+                stage_marks.append((time.perf_counter(), message["message"]))
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=settings.TIMEOUT)
+    else:
+        config = MockGatewayConfig(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+            history_size=args.history_size, emk_size=args.emk_size,
+        )
+        # Картотека из тех же пациентов, что и в выгрузке
+        config.registry = make_registry(config, make_patients(
+            max(1, args.rows // args.tests_per_patient), family_size=args.family_size
+        ))
+        mock = create_mock_gateway(config)
+        client = httpx.AsyncClient(
+            base_url=settings.BASE_URL, transport=httpx.ASGITransport(app=mock), timeout=settings.TIMEOUT
+        )
+
+    task_id = f"bench-{uuid.uuid4()}"
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            await run_processing_pipeline(
+                task_id, args.book, Path(tmp) / "report.xlsx", MeasuredGatewayService(client), BenchManager()
+            )
+    finally:
+        elapsed = time.perf_counter() - started
+        await client.aclose()
+        shutil.rmtree(RESULTS_DIR / task_id, ignore_errors=True)
+
+    stage_marks.append((started + elapsed, None))
+    stages = [
+        {"stage": message, "sec": round(next_at - at, 3)}
+        for (at, message), (next_at, _) in zip(stage_marks, stage_marks[1:])
+    ]
+    calls = {
+        name: {
+            "calls": len(values),
+            "p50_ms": round(_percentile(values, 50) * 1000, 1),
+            "p99_ms": round(_percentile(values, 99) * 1000, 1),
+        }
+        for name, values in sorted(latencies.items())
+    }
+    total_calls = sum(len(values) for values in latencies.values())
+    return {
+        "rows": args.rows,
+        "mode": args.mode,
+        "ok": final.get("progress") == 100,
+        "result": final.get("message"),
+        "total_sec": round(elapsed, 3),
+        "rows_per_sec": round(args.rows / elapsed, 1) if elapsed else 0.0,
+        "calls": total_calls,
+        "calls_per_row": round(total_calls / args.rows, 3) if args.rows else 0.0,
+        "gateway": calls,
+        "stages": stages,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_before_mb": round(rss_before, 1),
+    }
+
+
+def _print_summary(result: dict):
+    print(f"Режим {result['mode']}: {result['rows']} строк за {result['total_sec']} с "
+          f"({result['rows_per_sec']} строк/с), результат: {result['result']}")
+    print(f"Запросов к шлюзу: {result['calls']} ({result['calls_per_row']} на строку)")
+    for name, item in result["gateway"].items():
+        print(f"  {name:<26} {item['calls']:>7}  p50 {item['p50_ms']:>8} мс  p99 {item['p99_ms']:>8} мс")
+    print("Этапы:")
+    for stage in result["stages"]:
+        print(f"  {stage['sec']:>8} с  {stage['stage']}")
+    print(f"Пиковый RSS: {result['peak_rss_mb']} МБ (до запуска pipeline {result['rss_before_mb']} МБ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=3000)
+    parser.add_argument("--tests-per-patient", type=int, default=10)
+    parser.add_argument("--family-size", type=int, default=3, help="пациентов с одной фамилией подряд")
+    parser.add_argument("--person-batch-mode", choices=["off", "surname"], default="off",
+                        help="PERSON_BATCH_MODE")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="базовая задержка ответа шлюза")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="средняя случайная добавка к задержке")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--history-size", type=int, default=200, help="записей в истории анализов пациента")
+    parser.add_argument("--emk-size", type=int, default=50, help="событий в мед. истории пациента")
+    parser.add_argument("--mode", choices=["stages", "streaming"], default="stages")
+    parser.add_argument("--checkpoint-mode", choices=["off", "compact", "full"], default="compact")
+    parser.add_argument("--concurrency", type=int, default=10, help="PROCESSING_CONCURRENCY")
+    parser.add_argument("--rps", type=float, default=0, help="GATEWAY_RATE_LIMIT_RPS (0 — без ограничения)")
+    parser.add_argument("--url", help="адрес отдельно запущенного bench.mock_gateway")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    parser.add_argument("--book", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.book:
+        import asyncio
+
+        _configure_env(args)
+        print(json.dumps(asyncio.run(_run_pipeline(args)), ensure_ascii=False))
+        return
+
+    setup_env()
+    with tempfile.TemporaryDirectory() as tmp:
+        book_path = make_invitro_workbook(
+            Path(tmp) / "bench.xlsx", args.rows, args.tests_per_patient, family_size=args.family_size
+        )
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.bench_pipeline", *sys.argv[1:], "--book", str(book_path)],
+            check=True, capture_output=True, text=True
+        ).stdout.strip().splitlines()[-1]
+
+    result = json.loads(output)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        _print_summary(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Сравнение `sanitize_raw_data` с прежней построчной реализацией на синтетических строках выгрузки.
+
+    python -m bench.bench_sanitize --rows 100000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from bench.common import setup_env, make_patients
+
+setup_env()
+
+
+def _sanitize_raw_data_rowwise(data):
+    """Прежняя реализация `sanitize_raw_data`: каждое поле разбирается заново в каждой строке."""
+    from app.service.processing.sanitizer import _sanitize_name, _sanitize_birthday, _sanitize_float
+
+    sanitized = []
+    for row in data:
+        visit_date, raw_birthday, inz, full_name, test_code, test_name, test_quantity, test_price = row
+        last, first, middle = _sanitize_name(full_name)
+        birthday = _sanitize_birthday(raw_birthday)
+
+        sanitized.append({
+            "inz": inz,
+            "visit_date": visit_date,
+            "person": {
+                "last_name": last,
+                "first_name": first,
+                "middle_name": middle,
+                "birth_day": birthday
+            },
+            "test_src": {
+                "code": test_code,
+                "name": test_name,
+                "quantity": int(_sanitize_float(test_quantity)),
+                "price": _sanitize_float(test_price)
+            }
+        })
+    return sanitized
+
+
+def make_raw_rows(count: int, patients: int, seed: int = 1) -> list:
+    """Строки в формате `get_raw_data`; даты рождения в разных форматах, цены строками с запятой."""
+    rnd = random.Random(seed)
+    people = make_patients(patients, seed)
+    rows = []
+    for i in range(count):
+        patient = people[i % len(people)]
+        birthday = patient["birthday"]
+        raw_birthday = birthday.strftime("%d%m%y") if i % 3 == 0 else birthday.strftime("%d.%m.%Y")
+        code = rnd.randrange(1, 500)
+        rows.append([
+            (date(2024, 1, 1) + timedelta(days=i % 28)).strftime("%d.%m.%Y"), raw_birthday,
+            f"INZ{i:07d}", patient["full_name"].upper(), str(code), f"Услуга {code}", "1",
+            f"{rnd.randrange(100, 5000)},00"
+        ])
+    return rows
+
+
+def _measure(func, rows) -> tuple:
+    """Время замеряется без tracemalloc (он сильно замедляет выполнение), память — отдельным прогоном."""
+    started = time.perf_counter()
+    func(rows)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    result = func(rows)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, memory
+
+
+def main():
+    from app.service.processing.sanitizer import sanitize_raw_data
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--patients", type=int, default=500, help="число различных пациентов")
+    args = parser.parse_args()
+
+    rows = make_raw_rows(args.rows, args.patients)
+    print(f"Синтетические строки: {args.rows}, пациентов: {args.patients}")
+    results = {}
+    for name, func in (("rowwise", _sanitize_raw_data_rowwise), ("memoized", sanitize_raw_data)):
+        results[name], elapsed, memory = _measure(func, rows)
+        print(f"{name:>10}: {elapsed:.3f} с, {args.rows / elapsed:,.0f} строк/с, "
+              f"результат в памяти {memory / 1024 / 1024:.1f} МБ")
+    same = results["rowwise"] == [record.as_dict() for record in results["memoized"]]
+    print("Результаты совпадают" if same else "РЕЗУЛЬТАТЫ РАЗЛИЧАЮТСЯ")
+
+
+if __name__ == "__main__":
+    main()
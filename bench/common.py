@@ -0,0 +1,93 @@
+"""
+Общие утилиты для бенчмарков: окружение настроек и генерация синтетических выгрузок Invitro.
+
+Бенчмарки запускаются из корня проекта, например:
+    python -m bench.bench_get_raw_data
+"""
+import os
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+# Минимальный набор настроек, чтобы модули приложения импортировались без .env
+BENCH_ENV = {
+    "BASE_URL": "http://mock-gateway/",
+    "GATEWAY_REQUEST_ENDPOINT": "gateway/request",
+    "GATEWAY_SESSION_ID": "bench",
+    "GATEWAY_API_KEY": "bench",
+    "TIMEOUT": "30",
+    "HEADER_ORIGIN": "http://mock-gateway",
+    "HEADER_REFERER": "http://mock-gateway/",
+    "API_KEY": "bench",
+    "APP_API_KEY": "bench",
+    "START_ROW": "2",
+    "MAX_COL": "9",
+}
+
+
+def setup_env():
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+
+
+LAST_NAMES = ["Иванов", "Петров", "Сидоров", "Кузнецов", "Смирнов", "Попов", "Васильев", "Соколов"]
+FIRST_NAMES = ["Иван", "Петр", "Сергей", "Алексей", "Дмитрий", "Андрей"]
+MIDDLE_NAMES = ["Иванович", "Петрович", "Сергеевич", "Алексеевич", "Дмитриевич"]
+
+
+def make_patients(count: int, seed: int = 1, family_size: int = 1) -> list[dict]:
+    """Синтетические пациенты; `family_size` пациентов подряд носят одну фамилию."""
+    rnd = random.Random(seed)
+    patients = []
+    for i in range(count):
+        birthday = date(1940, 1, 1) + timedelta(days=rnd.randrange(0, 365 * 70))
+        last_name = f"{rnd.choice(LAST_NAMES)}{i}"
+        if i % family_size:
+            last_name = patients[-1]["full_name"].split()[0]
+        patients.append({
+            "full_name": f"{last_name} {rnd.choice(FIRST_NAMES)} {rnd.choice(MIDDLE_NAMES)}",
+            "birthday": birthday,
+        })
+    return patients
+
+
+def make_invitro_workbook(
+        path: Path, rows: int, tests_per_patient: int = 20, seed: int = 1, family_size: int = 1
+) -> Path:
+    """
+    Создает выгрузку в формате, который ожидает `get_raw_data` (данные с колонки B, со строки 2):
+    строка с датой визита, строка с датой рождения, затем строки с услугами.
+    """
+    from openpyxl import Workbook
+
+    rnd = random.Random(seed)
+    patients = make_patients(max(1, rows // tests_per_patient), seed, family_size)
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet()
+    sheet.append([None, "Заголовок выгрузки"])
+
+    written = 0
+    visit_date = date(2024, 1, 1)
+    while written < rows:
+        for patient in patients:
+            if written >= rows:
+                break
+            sheet.append([None, visit_date])
+            sheet.append([None, patient["birthday"], patient["full_name"]])
+            for _ in range(min(tests_per_patient, rows - written)):
+                code = f"{rnd.randrange(1, 500)}"
+                sheet.append([
+                    None, f"INZ{written:07d}", patient["full_name"], code,
+                    f"Услуга {code}", "1", f"{rnd.randrange(100, 5000)},00"
+                ])
+                written += 1
+        visit_date += timedelta(days=1)
+
+    book.save(path)
+    return path
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS текущего процесса в МБ (Linux)."""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
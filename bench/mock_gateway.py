@@ -0,0 +1,237 @@
+"""
+Имитация API-шлюза ЕВМИАС для бенчмарков.
+
+Отвечает на запросы, которые использует `app/service/processing/request.py`:
+Person/getPersonSearchGrid, UslugaComplex/loadUslugaContentsGrid,
+EvnUslugaPar/loadEvnUslugaParPanel, Template/getEvnForm,
+EMK/getPersonHistory, EMK/loadEvnVizitPLForm.
+
+Ответы детерминированы (зависят только от параметров запроса и seed), задержка,
+доля ошибок (503) и размер историй пациентов настраиваются через `MockGatewayConfig`.
+Поиск пациентов идет по картотеке (`make_registry`), если она задана: так работает
+и пакетный поиск по фамилии. Без картотеки каждый запрос по ФИО находит одного пациента.
+
+Можно использовать внутри процесса (`httpx.ASGITransport(app=create_mock_gateway(...))`)
+или запустить отдельным сервером:
+    python -m bench.mock_gateway --port 8081 --latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import zlib
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Типы оплаты из `pay_type_mapper.PAY_TYPE_IDS`
+PAY_TYPES = ["3010101000000048", "3010101000000046", "3010101000000049", "3010101000000051"]
+HISTORY_START = date(2023, 6, 1)
+HISTORY_DAYS = 365
+
+
+@dataclass
+class MockGatewayConfig:
+    latency_ms: float = 20.0         # базовая задержка ответа
+    jitter_ms: float = 10.0          # средняя случайная добавка (экспоненциальное распределение)
+    error_rate: float = 0.0          # доля ответов 503
+    history_size: int = 200          # записей в истории анализов пациента
+    emk_size: int = 50               # событий в мед. истории пациента
+    not_found_rate: float = 0.03     # доля пациентов, не найденных по ФИО
+    report_miss_rate: float = 0.3    # доля отчетов по анализу без типа оплаты (запасной механизм)
+    test_codes: int = 500            # число различных кодов услуг в истории
+    namesake_rate: float = 0.2       # доля пациентов картотеки с тезкой (другая дата рождения)
+    registry: list | None = None     # картотека пациентов (`make_registry`)
+    seed: int = 1
+
+
+def _rnd(config: MockGatewayConfig, *parts) -> random.Random:
+    """Генератор, зависящий только от параметров запроса."""
+    key = "|".join(str(part) for part in (config.seed, *parts))
+    return random.Random(zlib.crc32(key.encode("utf-8")))
+
+
+def _day(offset: int) -> date:
+    return HISTORY_START + timedelta(days=offset)
+
+
+def make_registry(config: MockGatewayConfig, patients: list) -> list:
+    """
+    Картотека пациентов из `bench.common.make_patients`: ФИО в верхнем регистре, как в ЕВМИАС.
+    Доля `not_found_rate` пациентов в картотеке отсутствует, у доли `namesake_rate`
+    есть тезка с той же фамилией и именем, но другими отчеством и датой рождения.
+    """
+    registry = []
+    for patient in patients:
+        last_name, first_name, middle_name = patient["full_name"].upper().split()
+        birthday = patient["birthday"]
+        rnd = _rnd(config, "registry", patient["full_name"], birthday)
+        if rnd.random() >= config.not_found_rate:
+            registry.append((last_name, first_name, middle_name, birthday.strftime("%d.%m.%Y")))
+        if rnd.random() < config.namesake_rate:
+            namesake_birthday = birthday + timedelta(days=rnd.randrange(1, 365 * 30))
+            registry.append((last_name, first_name, "НИКОЛАЕВИЧ", namesake_birthday.strftime("%d.%m.%Y")))
+    return registry
+
+
+def _person_row(key: tuple) -> dict:
+    last_name, first_name, middle_name, birthday = key
+    return {
+        "Person_id": str(zlib.crc32("|".join(key).upper().encode("utf-8"))),
+        "Person_Surname": last_name, "Person_Firname": first_name, "Person_Secname": middle_name,
+        "Person_BirthDay": birthday,
+    }
+
+
+def person_search(config: MockGatewayConfig, data: dict) -> dict:
+    key = (data["PersonSurName_SurName"], data["PersonFirName_FirName"],
+           data["PersonSecName_SecName"], data["PersonBirthDay_BirthDay"])
+    if config.registry is None:
+        rnd = _rnd(config, "person", *key)
+        if rnd.random() < config.not_found_rate:
+            return {"totalCount": 0, "data": []}
+        return {"totalCount": 1, "data": [_person_row(key)]}
+
+    # Как в ЕВМИАС: ФИО сравниваются по началу без учета регистра, пустые поля не учитываются
+    names = [name.upper() for name in key[:3]]
+    found = [
+        person for person in config.registry
+        if all(part.upper().startswith(name) for part, name in zip(person, names)) and key[3] in ("", person[3])
+    ]
+    limit = int(data.get("limit", 100))
+    return {"totalCount": len(found), "data": [_person_row(person) for person in found[:limit]]}
+
+
+def usluga_contents(config: MockGatewayConfig, data: dict) -> dict:
+    code = data["UslugaComplex_CodeName"]
+    return {"data": [{
+        "UslugaComplex_id": f"U{code}",
+        "UslugaComplex_Code": code,
+        "UslugaComplex_Name": f"Услуга {code}",
+    }]}
+
+
+def tests_history(config: MockGatewayConfig, data: dict) -> dict:
+    person_id = data["Person_id"]
+    rnd = _rnd(config, "history", person_id)
+    items = []
+    for i in range(config.history_size):
+        day = _day(rnd.randrange(HISTORY_DAYS))
+        code = rnd.randrange(1, config.test_codes)
+        items.append({
+            "Evn_id": f"{person_id}{i:04d}",
+            "ED_MedPersonal_id": rnd.randrange(1, 100),
+            "EvnUslugaPar_setDate": day.strftime("%d.%m.%Y"),
+            "UslugaComplex_Name": f"Услуга {code}",
+            "UslugaComplex_id": f"U{code}",
+            "UslugaComplex_AttributeList": "lab" if rnd.random() < 0.9 else "func",
+            "MedService_Name": "Лаборатория",
+            "sort": f"{day.isoformat()} {rnd.randrange(8, 20):02d}:00:00",
+        })
+    return {"data": items}
+
+
+def evn_form(config: MockGatewayConfig, data: dict) -> dict:
+    event_id = data["object_value"]
+    rnd = _rnd(config, "report", event_id)
+    if rnd.random() < config.report_miss_rate:
+        return {}
+    return {"map": {"EvnUslugaPar": {"item": [{"data": {
+        "EvnDirection_id": f"D{event_id}",
+        "PayType_id": rnd.choice(PAY_TYPES),
+    }}]}}}
+
+
+# Тип события мед. истории -> класс события для фильтра evnClassList
+EMK_EVENT_CLASSES = {"vizit": "EvnPL", "par": "EvnUslugaPar", "direction": "EvnDirection", "disp": "EvnPLDispDop13"}
+
+
+def person_history(config: MockGatewayConfig, data: dict) -> dict:
+    person_id = data["Person_id"]
+    classes = set(json.loads(data["evnClassList"])) if data.get("evnClassList") else None
+    rnd = _rnd(config, "emk", person_id)
+    events = []
+    for i in range(config.emk_size):
+        day = _day(rnd.randrange(HISTORY_DAYS))
+        evn_type = rnd.choice(["vizit", "vizit", "par", "direction", "disp"])
+        medpersonal_id, medstafffact_id = rnd.randrange(1, 100), rnd.randrange(1, 100)
+        if classes is not None and EMK_EVENT_CLASSES[evn_type] not in classes:
+            continue
+        events.append({
+            "EvnType": evn_type,
+            "objectSetDate": day.strftime("%d.%m.%Y"),
+            "objectDisDate": day.strftime("%d.%m.%Y"),
+            "MedPersonal_id": medpersonal_id,
+            "EvnClass_Name": "Посещение",
+            "Diag_Code": "Z00.0",
+            "Diag_Name": "Общий медицинский осмотр",
+            "children": [{"Evn_id": f"V{person_id}{i:03d}", "MedStaffFact_id": medstafffact_id}],
+        })
+    return {"data": events}
+
+
+def vizit_form(config: MockGatewayConfig, data: dict) -> list:
+    rnd = _rnd(config, "vizit", data["EvnVizitPL_id"])
+    return [{"PayType_id": rnd.choice(PAY_TYPES)}]
+
+
+HANDLERS = {
+    ("Person", "getPersonSearchGrid"): person_search,
+    ("UslugaComplex", "loadUslugaContentsGrid"): usluga_contents,
+    ("EvnUslugaPar", "loadEvnUslugaParPanel"): tests_history,
+    ("Template", "getEvnForm"): evn_form,
+    ("EMK", "getPersonHistory"): person_history,
+    ("EMK", "loadEvnVizitPLForm"): vizit_form,
+}
+
+
+def create_mock_gateway(config: MockGatewayConfig, endpoint: str = "/gateway/request") -> FastAPI:
+    app = FastAPI(title="Mock EVMIAS gateway")
+    app.state.config = config
+    app.state.calls = {}
+    noise = random.Random(config.seed)
+
+    @app.post(endpoint)
+    async def gateway_request(request: Request):
+        body = await request.json()
+        params, data = body.get("params", {}), body.get("data", {})
+        name = (params.get("c"), params.get("m"))
+        app.state.calls[name] = app.state.calls.get(name, 0) + 1
+
+        delay = config.latency_ms + (noise.expovariate(1 / config.jitter_ms) if config.jitter_ms > 0 else 0)
+        await asyncio.sleep(delay / 1000)
+
+        if noise.random() < config.error_rate:
+            return JSONResponse({"error": "mock failure"}, status_code=503)
+        handler = HANDLERS.get(name)
+        if handler is None:
+            return JSONResponse({"error": f"unknown method {name}"}, status_code=400)
+        return handler(config, data)
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=MockGatewayConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=MockGatewayConfig.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=MockGatewayConfig.error_rate)
+    parser.add_argument("--history-size", type=int, default=MockGatewayConfig.history_size)
+    parser.add_argument("--emk-size", type=int, default=MockGatewayConfig.emk_size)
+    args = parser.parse_args()
+
+    config = MockGatewayConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        history_size=args.history_size, emk_size=args.emk_size,
+    )
+    uvicorn.run(create_mock_gateway(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
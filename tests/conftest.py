@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench.common import setup_env  # noqa: E402
+
+# Настройки окружения нужны до импорта модулей приложения
+setup_env()
@@ -0,0 +1,48 @@
+"""
+Общая загрузка в `cached`: отмена вызова, начавшего загрузку, не затрагивает ожидающие вызовы.
+"""
+import asyncio
+
+import app.core  # noqa: F401  (порядок импорта модулей приложения)
+from app.service.processing.cache import cached
+
+
+def test_owner_cancellation_does_not_cancel_joiners():
+    calls = []
+
+    @cached("test_in_flight", ttl=60, maxsize=10)
+    async def lookup(service, key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return f"value-{key}"
+
+    async def scenario():
+        owner = asyncio.create_task(lookup(None, "k"))
+        await asyncio.sleep(0.01)
+        joiner = asyncio.create_task(lookup(None, "k"))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        result = await joiner
+        assert owner.cancelled()
+        return result, await lookup(None, "k")
+
+    assert asyncio.run(scenario()) == ("value-k", "value-k")
+    assert calls == ["k"]
+
+
+def test_errors_reach_joiners_and_are_not_cached():
+    calls = []
+
+    @cached("test_in_flight_error", ttl=60, maxsize=10)
+    async def lookup(service, key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        raise ValueError(key)
+
+    async def scenario():
+        results = await asyncio.gather(lookup(None, "k"), lookup(None, "k"), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        await asyncio.gather(lookup(None, "k"), return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert calls == ["k", "k"]
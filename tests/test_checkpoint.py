@@ -0,0 +1,32 @@
+"""
+Контрольные точки, сжатые zstd, без пакета zstandard: понятная ошибка при чтении и пропуск при возобновлении.
+"""
+import gzip
+
+import pytest
+
+import app.core  # noqa: F401  (порядок импорта модулей приложения)
+from app.service.processing import checkpoint, tool
+
+
+@pytest.fixture
+def without_zstandard(monkeypatch):
+    monkeypatch.setattr(tool, "zstandard", None)
+    monkeypatch.setattr(checkpoint, "zstandard", None)
+
+
+def test_load_json_reports_missing_zstandard(tmp_path, without_zstandard):
+    path = tmp_path / "03.persons_ids.json.zst"
+    path.write_bytes(b"\x28\xb5\x2f\xfd")
+    with pytest.raises(RuntimeError, match="zstandard"):
+        tool.load_json(path)
+
+
+def test_find_checkpoint_skips_zst(tmp_path, without_zstandard):
+    (tmp_path / "03.persons_ids.json.zst").write_bytes(b"\x28\xb5\x2f\xfd")
+    assert checkpoint.find_checkpoint(tmp_path / "03.persons_ids.json") is None
+
+    (tmp_path / "03.persons_ids.json.gz").write_bytes(gzip.compress(b"[]"))
+    found = checkpoint.find_checkpoint(tmp_path / "03.persons_ids.json")
+    assert found.name == "03.persons_ids.json.gz"
+    assert tool.load_json(found) == []
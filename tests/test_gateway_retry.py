@@ -0,0 +1,74 @@
+"""
+Повторы запросов к шлюзу и circuit breaker: кратковременный сбой не завершает задачу ошибкой.
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import app.core  # noqa: F401  (порядок импорта модулей приложения)
+from app.core.exceptions import GatewayConnectivityError
+from app.service import gateway_control
+from app.service.gateway import GatewayService
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = gateway_control.CircuitBreaker(failure_threshold=5, reset_timeout=0.3)
+    monkeypatch.setattr(gateway_control, "circuit_breaker", breaker)
+    monkeypatch.setattr(gateway_control, "backoff_delay", lambda attempt: 0.05 * 2 ** attempt)
+    # Без ограничения частоты: время повторов определяется только задержками выше
+    monkeypatch.setattr(gateway_control, "_rate_limiters", {})
+    monkeypatch.setattr(gateway_control.settings, "GATEWAY_RATE_LIMIT_RPS", 0)
+    return breaker
+
+
+def _service(is_down) -> GatewayService:
+    """Шлюз отвечает 503, пока `is_down()` истинно."""
+    async def handler(request):
+        if is_down():
+            return httpx.Response(503)
+        return httpx.Response(200, json={"ok": True})
+
+    return GatewayService(httpx.AsyncClient(base_url="http://gateway.test", transport=httpx.MockTransport(handler)))
+
+
+def _gather(service: GatewayService, count: int) -> list:
+    async def scenario():
+        return await asyncio.gather(*(service.make_request("post", json={}) for _ in range(count)),
+                                    return_exceptions=True)
+    return asyncio.run(scenario())
+
+
+def test_short_outage_is_retried(breaker):
+    started = time.monotonic()
+    service = _service(lambda: time.monotonic() - started < 0.15)
+
+    assert _gather(service, 10) == [{"ok": True}] * 10
+    assert breaker.state == breaker.CLOSED
+
+
+def test_rejected_requests_wait_for_probe(breaker):
+    down = True
+    service = _service(lambda: down)
+    # Каждый запрос не выполнен и после повторов: выключатель открывается
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(GatewayConnectivityError):
+            asyncio.run(service.make_request("post", json={}))
+    assert breaker.state == breaker.OPEN
+
+    # Отклоненные запросы дожидаются пробного запроса, а не завершаются ошибкой
+    down = False
+    assert _gather(service, 10) == [{"ok": True}] * 10
+    assert breaker.state == breaker.CLOSED
+    assert breaker.rejected > 0
+
+
+def test_sustained_outage_fails(breaker, monkeypatch):
+    monkeypatch.setattr(GatewayService.settings, "GATEWAY_BREAKER_WAIT_MAX", 0.5)
+    service = _service(lambda: True)
+
+    results = _gather(service, 10)
+    assert all(isinstance(result, GatewayConnectivityError) for result in results)
+    assert breaker.state == breaker.OPEN
@@ -0,0 +1,53 @@
+"""
+`MedicalHistoryIndex` находит то же событие, что и последовательный перебор истории.
+"""
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import app.core  # noqa: F401  (порядок импорта модулей приложения)
+from app.service.processing.sanitizer import MedicalHistoryIndex
+
+SKIPPED_TYPES = ("direction", "par", "disp")
+
+
+def first_event_linear(raw_data: dict | None, visit_date: str) -> dict | None:
+    """Эталон: первое по порядку истории посещение в окне (дата визита - 14 дней, дата визита]."""
+    visit_date = datetime.strptime(visit_date, "%d.%m.%Y")
+    for each in (raw_data or {}).get("data") or []:
+        if each["EvnType"] in SKIPPED_TYPES:
+            continue
+        if visit_date - timedelta(days=14) < datetime.strptime(each["objectSetDate"], "%d.%m.%Y") <= visit_date:
+            return each
+    return None
+
+
+def _history(rnd: random.Random, size: int) -> dict:
+    events = []
+    for i in range(size):
+        day = date(2024, 1, 1) + timedelta(days=rnd.randrange(60))
+        events.append({
+            "EvnType": rnd.choice(["vizit", "vizit", "par", "direction", "disp"]),
+            "objectSetDate": day.strftime("%d.%m.%Y"), "objectDisDate": "", "MedPersonal_id": i,
+            "EvnClass_Name": "c", "Diag_Code": "d", "Diag_Name": "n",
+            "children": [{"Evn_id": f"V{i}", "MedStaffFact_id": i}],
+        })
+    return {"data": events}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_first_event_matches_linear_scan(seed):
+    rnd = random.Random(seed)
+    history = _history(rnd, 40)
+    index = MedicalHistoryIndex(history)
+    for offset in range(-5, 80):
+        visit_date = (date(2024, 1, 1) + timedelta(days=offset)).strftime("%d.%m.%Y")
+        expected = first_event_linear(history, visit_date)
+        event = index.first_event(visit_date)
+        assert (event and event["children_evn_id"]) == (expected and expected["children"][0]["Evn_id"])
+
+
+@pytest.mark.parametrize("raw_data", [None, {}, {"data": None}, {"data": []}])
+def test_empty_history(raw_data):
+    assert MedicalHistoryIndex(raw_data).first_event("01.01.2024") is None
@@ -0,0 +1,68 @@
+"""
+Пакетный поиск ID пациентов находит тех же пациентов, что и поиск по одному, за меньшее число запросов.
+"""
+import asyncio
+from collections import Counter
+
+import pytest
+
+import app.core  # noqa: F401  (порядок импорта модулей приложения)
+from app.service.processing import getter
+from app.service.processing.cache import clear_caches
+from app.service.processing import record
+from bench.common import make_patients
+from bench.mock_gateway import MockGatewayConfig, make_registry, person_search
+
+
+class RegistryGateway:
+    def __init__(self, config: MockGatewayConfig):
+        self.config = config
+        self.calls = Counter()
+
+    async def make_request(self, method, json=None, **kwargs):
+        data = json["data"]
+        self.calls["batch" if not data["PersonBirthDay_BirthDay"] else "single"] += 1
+        return person_search(self.config, data)
+
+
+def _records(patients: list) -> list:
+    records = []
+    for i, patient in enumerate(patients):
+        last_name, first_name, middle_name = patient["full_name"].split()
+        person = record.Person(last_name, first_name, middle_name, patient["birthday"].strftime("%d.%m.%Y"))
+        records.append(record.Record(f"INZ{i}", "01.01.2024", person, record.TestSource("1", "test", 1, 100.0)))
+    return records
+
+
+def _person_ids(mode: str, service, patients, monkeypatch) -> list:
+    monkeypatch.setattr(getter.settings, "PERSON_BATCH_MODE", mode)
+    clear_caches()
+    data = asyncio.run(getter.get_ids(
+        service, _records(patients), task_id="test", manager=None, start_progress=0, end_progress=0
+    ))
+    return [row.person.id for row in data]
+
+
+@pytest.mark.parametrize("registry_case", [str.upper, str.lower])
+def test_batch_matches_single_lookup(registry_case, monkeypatch):
+    patients = make_patients(120, family_size=4)
+    config = MockGatewayConfig(not_found_rate=0.1, namesake_rate=0.3)
+    config.registry = [
+        tuple(registry_case(part) for part in person[:3]) + person[3:]
+        for person in make_registry(config, patients)
+    ]
+    # Тезка, чье имя отличается от имени пациента только буквой ё: шлюз (здесь — имитация)
+    # может их различать, поэтому такой пациент ищется отдельным запросом
+    patient = next(patient for patient in patients if "е" in patient["full_name"].split()[1])
+    last_name, first_name, middle_name = patient["full_name"].split()
+    config.registry.append((
+        last_name, first_name.replace("е", "ё"), middle_name, patient["birthday"].strftime("%d.%m.%Y")
+    ))
+
+    single = RegistryGateway(config)
+    expected = _person_ids("off", single, patients, monkeypatch)
+    batched = RegistryGateway(config)
+    assert _person_ids("surname", batched, patients, monkeypatch) == expected
+
+    assert batched.calls["batch"] == 120 // 4
+    assert sum(batched.calls.values()) < single.calls["single"]
@@ -0,0 +1,30 @@
+"""
+Чтение выгрузки Invitro не зависит от размера листа, записанного в файле (<dimension>).
+"""
+import re
+import zipfile
+
+import app.core  # noqa: F401  (порядок импорта модулей приложения)
+from app.service.processing.getter import get_raw_data
+from bench.common import make_invitro_workbook
+
+
+def _with_dimension(source, target, ref: str):
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            payload = src.read(item.filename)
+            if item.filename.startswith("xl/worksheets/"):
+                payload, count = re.subn(rb'<dimension ref="[^"]*"\s*/>', f'<dimension ref="{ref}"/>'.encode(), payload)
+                if not count:
+                    payload = payload.replace(b"<sheetData", f'<dimension ref="{ref}"/><sheetData'.encode(), 1)
+            dst.writestr(item, payload)
+    return target
+
+
+def test_wrong_dimension_does_not_lose_rows(tmp_path):
+    book = make_invitro_workbook(tmp_path / "input.xlsx", 240, tests_per_patient=6)
+    broken = _with_dimension(book, tmp_path / "broken.xlsx", "A1")
+
+    expected = list(get_raw_data(book, 2, 9))
+    assert len(expected) == 240
+    assert list(get_raw_data(broken, 2, 9)) == expected
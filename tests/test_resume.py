@@ -0,0 +1,120 @@
+"""
+Возобновление задачи после отказа шлюза посреди этапа:
+при повторном запуске запрашиваются только строки, не обработанные до отказа.
+"""
+import asyncio
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+import app.core  # noqa: F401  (порядок импорта модулей приложения)
+from app.core.exceptions import GatewayConnectivityError
+from app.service.processing.cache import clear_caches
+from app.service.processing.checkpoint import find_checkpoint
+from app.service.processing import pipeline
+from app.service.processing.tool import load_json
+from bench.common import make_invitro_workbook
+
+
+class FakeGateway:
+    """Шлюз с детерминированными ответами; считает успешные запросы по методам ЕВМИАС."""
+
+    def __init__(self, fail_method: str | None = None, fail_after: int = 0):
+        self.calls = Counter()
+        self.fail_method = fail_method
+        self.fail_after = fail_after
+        self._started = Counter()
+
+    async def make_request(self, method, json=None, **kwargs):
+        m, data = json["params"]["m"], json["data"]
+        self._started[m] += 1
+        if m == self.fail_method and self._started[m] > self.fail_after:
+            # Отказ чуть позже, чтобы часть запросов этапа успела завершиться
+            await asyncio.sleep(0.02)
+            raise GatewayConnectivityError("Шлюз вернул 503")
+        await asyncio.sleep(0.001)
+        self.calls[m] += 1
+        return self._response(m, data)
+
+    @staticmethod
+    def _response(m, data):
+        if m == "getPersonSearchGrid":
+            return {"totalCount": 1, "data": [{"Person_id": "P" + data["PersonSurName_SurName"]}]}
+        if m == "loadUslugaContentsGrid":
+            code = data["UslugaComplex_CodeName"]
+            return {"data": [{"UslugaComplex_Code": code, "UslugaComplex_id": "U" + code, "UslugaComplex_Name": "n"}]}
+        if m == "loadEvnUslugaParPanel":
+            return {"data": [{
+                "UslugaComplex_AttributeList": "lab", "Evn_id": f"E{data['Person_id']}{i}", "ED_MedPersonal_id": 1,
+                "EvnUslugaPar_setDate": "01.01.2024", "UslugaComplex_Name": "x", "MedService_Name": "g",
+                "UslugaComplex_id": f"U{i}", "sort": f"2024-01-{i + 1:02d} 10:00:00"
+            } for i in range(3)]}
+        if m == "getEvnForm":
+            if data["object_value"].endswith("1"):
+                return {}
+            return {"map": {"EvnUslugaPar": {"item": [{"data": {"EvnDirection_id": 5, "PayType_id": "3010101000000048"}}]}}}
+        if m == "getPersonHistory":
+            return {"data": [{
+                "EvnType": "vizit", "objectSetDate": "31.12.2023", "objectDisDate": "", "MedPersonal_id": 1,
+                "EvnClass_Name": "c", "Diag_Code": "d", "Diag_Name": "n",
+                "children": [{"Evn_id": "V" + data["Person_id"], "MedStaffFact_id": 7}]
+            }]}
+        if m == "loadEvnVizitPLForm":
+            return [{"PayType_id": "3010101000000046"}]
+        return {}
+
+
+class FakeManager:
+    async def send_progress(self, task_id, message):
+        pass
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    return make_invitro_workbook(tmp_path / "input.xlsx", 300, tests_per_patient=5)
+
+
+@pytest.fixture
+def results_dir(tmp_path, monkeypatch):
+    """Контрольные точки задач пишутся во временный каталог, а не в materials/results."""
+    path = tmp_path / "results"
+    path.mkdir()
+    monkeypatch.setattr(pipeline, "RESULTS_DIR", path)
+    return path
+
+
+def _run(task_id, workbook, output, service, resume=False):
+    clear_caches()
+    return asyncio.run(pipeline.run_processing_pipeline(task_id, workbook, output, service, FakeManager(), resume=resume))
+
+
+def _final_data(results_dir, task_id):
+    return load_json(find_checkpoint(results_dir / task_id / "09.pay_type_by_medical_history.json"))
+
+
+@pytest.mark.parametrize("method, stage", [
+    ("loadUslugaContentsGrid", "05.test_data_from_evmias"),
+    ("loadEvnUslugaParPanel", "06.persons_tests_history"),
+    ("getPersonHistory", "09.pay_type_by_medical_history"),
+    ("loadEvnVizitPLForm", "09.pay_type_by_medical_history"),
+])
+def test_resume_fetches_only_remaining_rows(method, stage, workbook, tmp_path, results_dir):
+    reference = FakeGateway()
+    reference_task = str(uuid.uuid4())
+    assert _run(reference_task, workbook, tmp_path / "reference.xlsx", reference) is None
+    total = reference.calls[method]
+
+    failing = FakeGateway(fail_method=method, fail_after=total // 3)
+    task_id = str(uuid.uuid4())
+    assert _run(task_id, workbook, tmp_path / "output.xlsx", failing) is not None
+    assert find_checkpoint(results_dir / task_id / f"{stage}.partial.json") is not None
+    done = failing.calls[method]
+    assert 0 < done < total
+
+    resumed = FakeGateway()
+    assert _run(task_id, workbook, tmp_path / "output.xlsx", resumed, resume=True) is None
+    # Каждая строка запрошена ровно один раз: до отказа или после возобновления
+    assert resumed.calls[method] == total - done
+    assert _final_data(results_dir, task_id) == _final_data(results_dir, reference_task)